@@ -1,14 +1,118 @@
+from django import forms
 from django.contrib import admin
+from django.contrib.auth import get_permission_codename, get_user_model
+from django.contrib.auth.models import Permission
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 
 from authmod import models
+from authmod.hierarchy import check_role_cycle
+
+
+def _count(queryset, field):
+    # Counting in a subquery avoids the row explosion of joining both
+    # relations of the role in the outer query.
+    counts = (
+        queryset.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(count=Count("*"))
+        .values("count")
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+@admin.register(Permission)
+class PermissionAdmin(admin.ModelAdmin):
+    """
+    Serves the autocomplete of the permission picker of roles. Hidden from
+    the admin index, and read-only. Users who may add or change roles may
+    view permissions.
+    """
+
+    search_fields = ("name", "codename", "content_type__app_label")
+    ordering = ("content_type__app_label", "content_type__model", "codename")
+    list_select_related = ("content_type",)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("content_type")
+
+    def get_model_perms(self, request):
+        return {}
+
+    def has_view_permission(self, request, obj=None):
+        if super().has_view_permission(request, obj):
+            return True
+        opts = models.Role._meta
+        return any(
+            request.user.has_perm(
+                "%s.%s" % (opts.app_label, get_permission_codename(action, opts))
+            )
+            for action in ("add", "change")
+        )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class RoleAdminForm(forms.ModelForm):
+    class Meta:
+        model = models.Role
+        fields = "__all__"
+
+    def clean_parents(self):
+        parents = self.cleaned_data["parents"]
+        if self.instance.pk is not None:
+            check_role_cycle([self.instance.pk], [role.pk for role in parents])
+        return parents
 
 
 @admin.register(models.Role)
 class RoleAdmin(admin.ModelAdmin):
+    form = RoleAdminForm
     list_display = (
         "id",
         "name",
         "is_default",
+        "user_count",
+        "permission_count",
     )
     list_display_links = ("id", "name")
     list_filter = ("is_default",)
+    search_fields = ("name",)
+    # Permissions are searched and loaded page by page, grouped by app and
+    # model, instead of rendering thousands of options.
+    autocomplete_fields = ("permissions", "parents")
+
+    def get_queryset(self, request):
+        return (
+            super()
+            .get_queryset(request)
+            .annotate(
+                user_count=_count(get_user_model()._default_manager, "role"),
+                permission_count=_count(
+                    models.Role.permissions.through.objects, "role"
+                ),
+            )
+        )
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        formfield = super().formfield_for_manytomany(db_field, request, **kwargs)
+        if db_field.name == "permissions":
+            # Labels of the selected permissions include their content type.
+            formfield.queryset = formfield.queryset.select_related("content_type")
+        return formfield
+
+    @admin.display(description="users", ordering="user_count")
+    def user_count(self, obj):
+        return obj.user_count
+
+    @admin.display(description="permissions", ordering="permission_count")
+    def permission_count(self, obj):
+        return obj.permission_count
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AuthmodConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "authmod"
+
+    def ready(self):
+        from authmod import signals  # noqa: F401
@@ -0,0 +1,305 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.contrib.auth.models import Permission
+from django.core.cache import caches
+
+from authmod.conf import get_setting
+from authmod.instrumentation import stats
+from authmod.models import RoleAncestor
+
+ROLE_VERSION_KEY = "authmod:role:%s:version"
+ROLE_PERMS_KEY = "authmod:role:%s:%s:perms"
+USER_VERSION_KEY = "authmod:user:%s:version"
+
+
+class LRUCache:
+    """
+    A thread-safe, size-limited mapping whose entries expire `ttl` seconds
+    after they were stored.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# Role permissions shared by every user object of the process.
+local_role_cache = LRUCache(
+    get_setting("LOCAL_ROLE_CACHE_SIZE"), get_setting("LOCAL_ROLE_CACHE_TTL")
+)
+
+# Permissions of role combinations, shared by every user object holding the
+# same roles.
+local_role_set_cache = LRUCache(
+    get_setting("LOCAL_ROLE_CACHE_SIZE"), get_setting("LOCAL_ROLE_CACHE_TTL")
+)
+
+
+def _get_cache():
+    return caches[get_setting("CACHE_ALIAS")]
+
+
+def _new_version():
+    # Versions start from the current time, so a version key that was evicted
+    # or deleted never comes back with a value that was used before.
+    return time.time_ns()
+
+
+def _get_version(key):
+    cache = _get_cache()
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+async def _aget_version(key):
+    cache = _get_cache()
+    version = await cache.aget(key)
+    if version is None:
+        version = _new_version()
+        if not await cache.aadd(key, version, timeout=None):
+            version = await cache.aget(key, version)
+    return version
+
+
+def _bump_version(key):
+    cache = _get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), timeout=None)
+
+
+def get_role_version(role_id):
+    """
+    Return the current version of the role `role_id`. The version changes
+    every time the permissions of the role change.
+    """
+    return _get_version(ROLE_VERSION_KEY % role_id)
+
+
+async def aget_role_version(role_id):
+    return await _aget_version(ROLE_VERSION_KEY % role_id)
+
+
+def bump_role_version(*role_ids):
+    """
+    Invalidate the cached permissions of the given roles in every process
+    sharing the cache.
+    """
+    for role_id in role_ids:
+        local_role_cache.delete(role_id)
+        _bump_version(ROLE_VERSION_KEY % role_id)
+
+
+def get_user_version(user_id):
+    """
+    Return the current version of the user `user_id`. The version changes
+    every time the direct permissions of the user change.
+    """
+    return _get_version(USER_VERSION_KEY % user_id)
+
+
+def bump_user_version(*user_ids):
+    """
+    Invalidate data derived from the direct permissions of the given users.
+    """
+    # A deleted version comes back as a new one, so thousands of users are
+    # invalidated with a single cache call.
+    _get_cache().delete_many([USER_VERSION_KEY % user_id for user_id in user_ids])
+
+
+def _get_role_permission_rows(role_ids):
+    granted = (
+        Permission.objects.filter(role__in=role_ids)
+        .values_list("role", "content_type__app_label", "codename")
+        .order_by()
+    )
+    inherited = (
+        RoleAncestor.objects.filter(
+            role__in=role_ids, ancestor__permissions__isnull=False
+        )
+        .values_list(
+            "role",
+            "ancestor__permissions__content_type__app_label",
+            "ancestor__permissions__codename",
+        )
+        .order_by()
+    )
+    return granted.union(inherited, all=True)
+
+
+def _group_role_permissions(role_ids, rows):
+    perms = {role_id: set() for role_id in role_ids}
+    for role_id, ct, name in rows:
+        perms[role_id].add("%s.%s" % (ct, name))
+    return {role_id: frozenset(names) for role_id, names in perms.items()}
+
+
+def _load_role_permissions(role_ids):
+    return _group_role_permissions(role_ids, _get_role_permission_rows(role_ids))
+
+
+async def _aload_role_permissions(role_ids):
+    rows = [row async for row in _get_role_permission_rows(role_ids)]
+    return _group_role_permissions(role_ids, rows)
+
+
+def get_role_permissions(role_id):
+    """
+    Return a frozenset of permission strings granted to the role `role_id`
+    or inherited from its ancestors. Results are kept in memory and shared
+    through the cache, so a role whose permissions are already cached costs
+    no database query.
+    """
+    perms = local_role_cache.get(role_id)
+    if stats.enabled:
+        stats.record_cache("local", perms is not None, perms is None)
+    if perms is not None:
+        return perms
+
+    cache = _get_cache()
+    key = ROLE_PERMS_KEY % (role_id, get_role_version(role_id))
+    perms = cache.get(key)
+    if stats.enabled:
+        stats.record_cache("shared", perms is not None, perms is None)
+    if perms is None:
+        perms = _load_role_permissions([role_id])[role_id]
+        cache.set(key, perms, get_setting("ROLE_CACHE_TIMEOUT"))
+    local_role_cache.set(role_id, perms)
+    return perms
+
+
+async def aget_role_permissions(role_id):
+    perms = local_role_cache.get(role_id)
+    if stats.enabled:
+        stats.record_cache("local", perms is not None, perms is None)
+    if perms is not None:
+        return perms
+
+    cache = _get_cache()
+    key = ROLE_PERMS_KEY % (role_id, await aget_role_version(role_id))
+    perms = await cache.aget(key)
+    if stats.enabled:
+        stats.record_cache("shared", perms is not None, perms is None)
+    if perms is None:
+        perms = (await _aload_role_permissions([role_id]))[role_id]
+        await cache.aset(key, perms, get_setting("ROLE_CACHE_TIMEOUT"))
+    local_role_cache.set(role_id, perms)
+    return perms
+
+
+def get_many_role_permissions(role_ids):
+    """
+    Return a dict mapping every role of `role_ids` to its frozenset of
+    permission strings. Roles missing from the cache are loaded with a single
+    query.
+    """
+    perms = {}
+    for role_id in role_ids:
+        role_perms = local_role_cache.get(role_id)
+        if role_perms is not None:
+            perms[role_id] = role_perms
+    role_ids = set(role_ids).difference(perms)
+    if stats.enabled:
+        stats.record_cache("local", len(perms), len(role_ids))
+    if not role_ids:
+        return perms
+
+    cache = _get_cache()
+    versions = cache.get_many([ROLE_VERSION_KEY % role_id for role_id in role_ids])
+
+    keys = {}
+    for role_id in role_ids:
+        version = versions.get(ROLE_VERSION_KEY % role_id)
+        if version is None:
+            version = get_role_version(role_id)
+        keys[role_id] = ROLE_PERMS_KEY % (role_id, version)
+
+    cached = cache.get_many(keys.values())
+    fetched = {role_id: cached[key] for role_id, key in keys.items() if key in cached}
+    missing = role_ids.difference(fetched)
+    if stats.enabled:
+        stats.record_cache("shared", len(fetched), len(missing))
+    if missing:
+        loaded = _load_role_permissions(missing)
+        cache.set_many(
+            {keys[role_id]: loaded[role_id] for role_id in loaded},
+            get_setting("ROLE_CACHE_TIMEOUT"),
+        )
+        fetched.update(loaded)
+    for role_id, role_perms in fetched.items():
+        local_role_cache.set(role_id, role_perms)
+    perms.update(fetched)
+    return perms
+
+
+def get_role_set_permissions(role_ids, role_perms=None):
+    """
+    Return a frozenset of the permission strings granted by any of the roles
+    `role_ids`, given the permissions of each role `role_perms` if they were
+    already fetched. The union is computed once per combination of roles and
+    rebuilt only when the permissions of one of them change.
+    """
+    role_ids = frozenset(role_ids)
+    if role_perms is None:
+        role_perms = get_many_role_permissions(role_ids)
+    return _union_role_permissions(role_ids, role_perms)
+
+
+async def aget_role_set_permissions(role_ids):
+    role_ids = frozenset(role_ids)
+    role_perms = {role_id: await aget_role_permissions(role_id) for role_id in role_ids}
+    return _union_role_permissions(role_ids, role_perms)
+
+
+def _union_role_permissions(role_ids, role_perms):
+    if not role_ids:
+        return frozenset()
+    parts = tuple(role_perms[role_id] for role_id in sorted(role_ids))
+    if len(parts) == 1:
+        return parts[0]
+
+    entry = local_role_set_cache.get(role_ids)
+    if entry is None or any(
+        cached is not part and cached != part for cached, part in zip(entry[0], parts)
+    ):
+        entry = (parts, frozenset().union(*parts))
+        local_role_set_cache.set(role_ids, entry)
+    return entry[1]
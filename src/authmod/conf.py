@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+DEFAULTS = {
+    # Alias of the Django cache used to share permission data between
+    # processes.
+    "CACHE_ALIAS": "default",
+    # Timeout of cached role permission sets. Entries are versioned, so this
+    # only bounds how long unused versions stay in the cache.
+    "ROLE_CACHE_TIMEOUT": DEFAULT_TIMEOUT,
+    # Number of roles whose permissions each process keeps in memory, and for
+    # how many seconds. Other processes' changes are seen after at most this
+    # many seconds, or as soon as the invalidation transport is polled.
+    "LOCAL_ROLE_CACHE_SIZE": 1024,
+    "LOCAL_ROLE_CACHE_TTL": 60,
+    # Keep the effective_user_permission table up to date and use it to
+    # answer `with_perm`.
+    "MATERIALIZE_PERMISSIONS": False,
+    # Give users the permissions of their additional `roles` on top of their
+    # main role.
+    "MULTIPLE_ROLES": False,
+    # Also grant the global permissions of users, from their roles and their
+    # `user_permissions`, in object permission checks. Otherwise, like
+    # Django's ModelBackend, only roles held over the object count.
+    "GLOBAL_OBJECT_PERMISSIONS": False,
+    # Record counters and timings of permission checks and cache lookups, see
+    # authmod.instrumentation.
+    "INSTRUMENTATION": False,
+    # Dotted path of the transport publishing permission changes to the other
+    # processes, or None to not publish them, see authmod.invalidation.
+    "INVALIDATION_TRANSPORT": "authmod.invalidation.DatabaseTransport",
+    # Minimum number of seconds between two polls of the transport by a
+    # process.
+    "INVALIDATION_POLL_INTERVAL": 1,
+    # Authenticate with an indexed case-insensitive email lookup, hashing in a
+    # pool of AUTHENTICATION_WORKERS processes (0 to hash in the request
+    # thread), and store upgraded hashes in batches REHASH_DELAY seconds
+    # after the first login needing it, see authmod.passwords.schedule_rehash.
+    "FAST_AUTHENTICATION": False,
+    "AUTHENTICATION_WORKERS": 2,
+    "REHASH_DELAY": 5,
+    # Fields of the user loaded for `request.user`, on top of the username and
+    # what authorization needs, or None to load every field. Others are
+    # loaded with one query each on first access.
+    "REQUEST_USER_FIELDS": None,
+}
+
+
+def get_setting(name):
+    """
+    Return the value of `AUTHMOD_<name>` from the project settings, falling
+    back to the authmod default.
+    """
+    return getattr(settings, "AUTHMOD_%s" % name, DEFAULTS[name])
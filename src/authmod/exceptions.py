@@ -0,0 +1,14 @@
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+
+
+class DefaultRoleNotFound(ObjectDoesNotExist):
+    """
+    Raised when a user without a role is saved and no role is marked as the
+    default one.
+    """
+
+
+class RoleCycleError(ValidationError):
+    """
+    Raised when a role is made a parent of itself or of one of its ancestors.
+    """
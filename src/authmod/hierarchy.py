@@ -0,0 +1,111 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils.translation import gettext as _
+
+from authmod.exceptions import RoleCycleError
+from authmod.models import Role, RoleAncestor
+
+# Number of rows inserted per statement when rebuilding the closure.
+BATCH_SIZE = 5000
+
+
+def get_descendant_ids(role_ids):
+    """
+    Return the set of `role_ids` together with the ids of every role
+    inheriting from one of them.
+    """
+    role_ids = set(role_ids)
+    if role_ids:
+        role_ids.update(
+            RoleAncestor.objects.filter(ancestor__in=role_ids).values_list(
+                "role_id", flat=True
+            )
+        )
+    return role_ids
+
+
+def get_ancestor_ids(role_ids):
+    """
+    Return the set of `role_ids` together with the ids of every role one of
+    them inherits from.
+    """
+    role_ids = set(role_ids)
+    if role_ids:
+        role_ids.update(
+            RoleAncestor.objects.filter(role__in=role_ids).values_list(
+                "ancestor_id", flat=True
+            )
+        )
+    return role_ids
+
+
+def check_role_cycle(child_ids, parent_ids):
+    """
+    Raise RoleCycleError if making the roles `parent_ids` parents of the roles
+    `child_ids` would make a role inherit from itself.
+    """
+    child_ids, parent_ids = set(child_ids), set(parent_ids)
+    inherited = RoleAncestor.objects.filter(role__in=parent_ids, ancestor__in=child_ids)
+    if child_ids & parent_ids or inherited.exists():
+        raise RoleCycleError(
+            _("A role cannot inherit from itself or from one of its descendants."),
+            code="role_cycle",
+        )
+
+
+def link_roles(child_ids, parent_ids):
+    """
+    Add the closure rows created by making the roles `parent_ids` parents of
+    the roles `child_ids`: every descendant of a child inherits from every
+    ancestor of a parent.
+    """
+    descendant_ids = get_descendant_ids(child_ids)
+    ancestor_ids = get_ancestor_ids(parent_ids)
+    RoleAncestor.objects.bulk_create(
+        [
+            RoleAncestor(role_id=role_id, ancestor_id=ancestor_id)
+            for role_id in descendant_ids
+            for ancestor_id in ancestor_ids
+        ],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def refresh_role_closure(role_ids=None):
+    """
+    Rebuild the closure rows of the roles `role_ids` and of their descendants
+    from `Role.parents`. Rebuild the whole table when `role_ids` is None.
+    """
+    parents = defaultdict(set)
+    edges = Role.parents.through.objects.values_list("from_role_id", "to_role_id")
+    for role_id, parent_id in edges:
+        parents[role_id].add(parent_id)
+
+    ancestors = {}
+
+    def get_ancestors(role_id):
+        if role_id not in ancestors:
+            ancestors[role_id] = set()
+            for parent_id in parents[role_id]:
+                ancestors[role_id].add(parent_id)
+                ancestors[role_id].update(get_ancestors(parent_id))
+        return ancestors[role_id]
+
+    with transaction.atomic():
+        rows = RoleAncestor.objects.all()
+        if role_ids is None:
+            role_ids = set(parents)
+        else:
+            role_ids = get_descendant_ids(role_ids)
+            rows = rows.filter(role__in=role_ids)
+        rows.delete()
+        RoleAncestor.objects.bulk_create(
+            [
+                RoleAncestor(role_id=role_id, ancestor_id=ancestor_id)
+                for role_id in role_ids
+                for ancestor_id in get_ancestors(role_id)
+            ],
+            batch_size=BATCH_SIZE,
+        )
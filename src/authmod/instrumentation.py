@@ -0,0 +1,146 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.db import connection
+from django.dispatch import Signal
+
+from authmod.conf import get_setting
+
+# Upper bounds, in microseconds, of the buckets of the timing histograms.
+TIMING_BUCKETS = (10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+# Sent after every instrumented backend call with the arguments `backend`
+# (the backend instance), `method`, `perms` (the permissions checked, if
+# any), `duration` in seconds and `queries`, the number of database queries
+# issued, or None for async calls.
+permission_checked = Signal()
+
+
+class PermissionStats:
+    """
+    In-process counters of permission checks. Recording is skipped entirely
+    unless AUTHMOD_INSTRUMENTATION is enabled.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._calls = Counter()
+            self._durations = defaultdict(float)
+            self._histograms = defaultdict(lambda: [0] * (len(TIMING_BUCKETS) + 1))
+            self._queries = Counter()
+            self._perms = Counter()
+            self._cache = Counter()
+
+    def record_call(self, backend, method, perms, duration, queries):
+        key = "%s.%s" % (backend, method)
+        bucket = bisect.bisect_left(TIMING_BUCKETS, duration * 1e6)
+        with self._lock:
+            self._calls[key] += 1
+            self._durations[key] += duration
+            self._histograms[key][bucket] += 1
+            if queries:
+                self._queries[key] += queries
+            self._perms.update(perms)
+
+    def record_cache(self, cache, hits, misses):
+        with self._lock:
+            self._cache["%s.hits" % cache] += hits
+            self._cache["%s.misses" % cache] += misses
+
+    def snapshot(self, top=10):
+        """
+        Return the current stats as a dict that can be serialized to JSON.
+        """
+        with self._lock:
+            methods = {
+                key: {
+                    "calls": calls,
+                    "total_ms": round(self._durations[key] * 1e3, 3),
+                    "queries": self._queries[key],
+                    "histogram_us": dict(
+                        zip(
+                            [str(bound) for bound in TIMING_BUCKETS] + ["inf"],
+                            self._histograms[key],
+                        )
+                    ),
+                }
+                for key, calls in self._calls.items()
+            }
+            return {
+                "enabled": self.enabled,
+                "methods": methods,
+                "cache": dict(self._cache),
+                "top_permissions": self._perms.most_common(top),
+            }
+
+
+stats = PermissionStats(enabled=get_setting("INSTRUMENTATION"))
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _get_perms(method, args):
+    if method.endswith("has_perm"):
+        return (args[1],)
+    if method.endswith("has_perms"):
+        return tuple(args[1])
+    return ()
+
+
+def _record(backend, method, args, duration, queries):
+    perms = _get_perms(method, args)
+    stats.record_call(type(backend).__name__, method, perms, duration, queries)
+    if permission_checked.has_listeners():
+        permission_checked.send(
+            sender=type(backend),
+            backend=backend,
+            method=method,
+            perms=perms,
+            duration=duration,
+            queries=queries,
+        )
+
+
+def instrument(backend, name, method):
+    """
+    Wrap the bound method `name` of `backend` to record every call.
+    """
+    if inspect.iscoroutinefunction(method):
+
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                _record(backend, name, args, time.perf_counter() - start, None)
+
+    else:
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            counter = _QueryCounter()
+            start = time.perf_counter()
+            try:
+                with connection.execute_wrapper(counter):
+                    return method(*args, **kwargs)
+            finally:
+                _record(backend, name, args, time.perf_counter() - start, counter.count)
+
+    return wrapper
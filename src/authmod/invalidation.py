@@ -0,0 +1,139 @@
+import threading
+import time
+
+from django.db import transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from authmod.cache import local_role_cache, local_role_set_cache
+from authmod.conf import get_setting
+from authmod.models import InvalidationGeneration, clear_default_role_cache
+from authmod.registry import registry
+
+ROLE = "role"
+USER = "user"
+PERMISSION = "permission"
+
+GENERATION_NAME = "permissions"
+
+
+# A transport tells every process of every node that permission data changed,
+# so they drop what they keep in memory: role permissions in the local LRU
+# caches, the permission registry and the default role. Versions kept in the
+# shared cache already cover the data cached there.
+#
+# `publish(kind, ids)` announces that the objects `ids` of `kind` changed, once
+# the transaction has committed. `poll()` returns the `(kind, ids)` published
+# since its last call, or None when it can't tell what changed.
+
+
+class DatabaseTransport:
+    """
+    Keep a generation counter in the database, incremented by every change.
+    A process polling the counter only learns that something changed, so it
+    drops all of its local permission data. Needs no service besides the
+    database, and a poll is a primary key lookup.
+    """
+
+    def __init__(self):
+        self._generation = None
+
+    def publish(self, kind, ids):
+        generations = InvalidationGeneration.objects.filter(pk=GENERATION_NAME)
+        if not generations.update(generation=F("generation") + 1):
+            InvalidationGeneration.objects.get_or_create(
+                pk=GENERATION_NAME, defaults={"generation": 1}
+            )
+
+    def poll(self):
+        generation = (
+            InvalidationGeneration.objects.filter(pk=GENERATION_NAME)
+            .values_list("generation", flat=True)
+            .first()
+        ) or 0
+        previous, self._generation = self._generation, generation
+        # A process starts without local data, so there is nothing to drop
+        # on its first poll.
+        if previous is None or generation == previous:
+            return []
+        return None
+
+
+_transport = None
+_transport_loaded = False
+_last_poll = 0
+_lock = threading.Lock()
+
+
+def get_transport():
+    """
+    Return the transport set in AUTHMOD_INVALIDATION_TRANSPORT, or None.
+    """
+    global _transport, _transport_loaded
+    if not _transport_loaded:
+        path = get_setting("INVALIDATION_TRANSPORT")
+        _transport = import_string(path)() if path else None
+        _transport_loaded = True
+    return _transport
+
+
+def reset_transport():
+    """
+    Forget the transport. Called when AUTHMOD_INVALIDATION_TRANSPORT changes.
+    """
+    global _transport, _transport_loaded, _last_poll
+    _transport = None
+    _transport_loaded = False
+    _last_poll = 0
+
+
+def publish(kind, ids=()):
+    """
+    Publish the change of the objects `ids` of `kind` once the current
+    transaction commits.
+    """
+    transport = get_transport()
+    if transport is not None:
+        ids = list(ids)
+        transaction.on_commit(lambda: transport.publish(kind, ids))
+
+
+def apply(events):
+    """
+    Drop the local data made stale by `events`, or all local data if
+    `events` is None.
+    """
+    if events is None:
+        local_role_cache.clear()
+        local_role_set_cache.clear()
+        registry.invalidate()
+        clear_default_role_cache()
+        return
+
+    for kind, ids in events:
+        if kind == ROLE:
+            for role_id in ids:
+                local_role_cache.delete(role_id)
+            local_role_set_cache.clear()
+            clear_default_role_cache()
+        elif kind == PERMISSION:
+            registry.invalidate()
+
+
+def poll(force=False):
+    """
+    Apply the changes published by other processes. The transport is polled
+    at most once every AUTHMOD_INVALIDATION_POLL_INTERVAL seconds, unless
+    `force` is True.
+    """
+    global _last_poll
+    transport = get_transport()
+    if transport is None:
+        return
+
+    now = time.monotonic()
+    with _lock:
+        if not force and now - _last_poll < get_setting("INVALIDATION_POLL_INTERVAL"):
+            return
+        _last_poll = now
+    apply(transport.poll())
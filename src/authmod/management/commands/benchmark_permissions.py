@@ -0,0 +1,202 @@
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from authmod.backends import RoleBasedModelBackend
+from authmod.cache import bump_role_version, local_role_cache, local_role_set_cache
+from authmod.models import Role, clear_default_role_cache
+from authmod.registry import registry
+
+FAST_PASSWORD_HASHER = "django.contrib.auth.hashers.MD5PasswordHasher"
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed users, roles and permissions, measure the latency and query count "
+        "of permission checks and write the results as JSON. Seeded rows are "
+        "rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--roles", type=int, default=50)
+        parser.add_argument("--permissions", type=int, default=200)
+        parser.add_argument(
+            "--role-permissions",
+            type=int,
+            default=20,
+            help="Number of permissions granted to each role.",
+        )
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=100,
+            help="Number of users each operation is measured on, cold and warm.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--output", help="File to write the results to, instead of stdout."
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            results = self.run(options)
+            transaction.set_rollback(True)
+        # The rolled back rows may still be cached in this process.
+        clear_default_role_cache()
+        local_role_cache.clear()
+        local_role_set_cache.clear()
+        registry.clear()
+
+        data = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(data + "\n")
+        else:
+            self.stdout.write(data)
+
+    def seed(self, options, rand):
+        UserModel = get_user_model()
+        content_type = ContentType.objects.get_for_model(Permission)
+        perms = Permission.objects.bulk_create(
+            [
+                Permission(
+                    name="Benchmark permission %d" % index,
+                    codename="benchmark_%d_%d" % (options["seed"], index),
+                    content_type=content_type,
+                )
+                for index in range(options["permissions"])
+            ]
+        )
+        # bulk_create() sends no signal, and may not set primary keys.
+        registry.invalidate()
+        perms = list(
+            Permission.objects.filter(
+                content_type=content_type,
+                codename__startswith="benchmark_%d_" % options["seed"],
+            ).select_related("content_type")
+        )
+
+        roles = []
+        for index in range(options["roles"]):
+            role = Role.objects.create(
+                name="benchmark-%d-%d" % (options["seed"], index),
+                is_default=index == 0,
+            )
+            role.permissions.add(
+                *rand.sample(perms, min(options["role_permissions"], len(perms)))
+            )
+            roles.append(role)
+
+        # Password hashing would make up most of the seeding time.
+        with override_settings(PASSWORD_HASHERS=[FAST_PASSWORD_HASHER]):
+            for index in range(options["users"]):
+                user = UserModel._default_manager.create_user(
+                    **{
+                        UserModel.USERNAME_FIELD: "benchmark-%d-%d@example.com"
+                        % (options["seed"], index),
+                        "password": "benchmark",
+                        "role": rand.choice(roles),
+                    }
+                )
+                if rand.random() < 0.1:
+                    user.user_permissions.add(rand.choice(perms))
+        return perms, roles
+
+    def run(self, options):
+        if options["users"] < 1 or options["roles"] < 1 or options["iterations"] < 1:
+            raise CommandError("At least one user, role and iteration are needed.")
+        rand = random.Random(options["seed"])
+        perms, roles = self.seed(options, rand)
+
+        UserModel = get_user_model()
+        user_ids = list(UserModel._default_manager.values_list("pk", flat=True))
+        user_ids = rand.sample(user_ids, min(options["iterations"], len(user_ids)))
+        role_ids = [role.pk for role in roles]
+
+        perm_strs = ["%s.%s" % (p.content_type.app_label, p.codename) for p in perms]
+        perm = perm_strs[0]
+        perm_list = perm_strs[:5]
+        app_label = perms[0].content_type.app_label
+        backend = RoleBasedModelBackend()
+
+        operations = {
+            "user.has_perm": lambda user: user.has_perm(perm),
+            "user.has_perms": lambda user: user.has_perms(perm_list),
+            "user.has_module_perms": lambda user: user.has_module_perms(app_label),
+            "user.get_all_permissions": lambda user: user.get_all_permissions(),
+            "backend.has_perm": lambda user: backend.has_perm(user, perm),
+            "backend.get_all_permissions": lambda user: (
+                backend.get_all_permissions(user)
+            ),
+            "backend.with_perm": lambda user: list(backend.with_perm(perm)),
+        }
+
+        results = {}
+        for name, operation in operations.items():
+            cold = []
+            for user_id in user_ids:
+                user = UserModel._default_manager.get(pk=user_id)
+                # Drop what this process and the shared cache know about roles.
+                bump_role_version(*role_ids)
+                local_role_set_cache.clear()
+                registry.clear()
+                cold.append(self.measure(operation, user))
+
+            warm = []
+            for user_id in user_ids:
+                user = UserModel._default_manager.get(pk=user_id)
+                operation(user)
+                warm.append(self.measure(operation, user))
+
+            results[name] = {"cold": self.summarize(cold), "warm": self.summarize(warm)}
+
+        return {
+            "created": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "platform": sys.platform,
+            "options": {
+                key: options[key]
+                for key in (
+                    "users",
+                    "roles",
+                    "permissions",
+                    "role_permissions",
+                    "iterations",
+                    "seed",
+                )
+            },
+            "results": results,
+        }
+
+    def measure(self, operation, user):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            operation(user)
+            elapsed = time.perf_counter() - start
+        return elapsed, len(queries)
+
+    def summarize(self, samples):
+        times = sorted(elapsed * 1e6 for elapsed, _ in samples)
+        return {
+            "calls": len(samples),
+            "mean_us": round(statistics.fmean(times), 2),
+            "median_us": round(statistics.median(times), 2),
+            "p95_us": round(times[int(0.95 * (len(times) - 1))], 2),
+            "max_us": round(times[-1], 2),
+            "queries": round(statistics.fmean(q for _, q in samples), 2),
+        }
@@ -0,0 +1,28 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from authmod.instrumentation import stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Dump the permission check stats recorded by this process as JSON. "
+        "Stats are only recorded when AUTHMOD_INSTRUMENTATION is enabled."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--top",
+            type=int,
+            default=10,
+            help="Number of most checked permissions to list.",
+        )
+        parser.add_argument(
+            "--reset", action="store_true", help="Reset the stats once dumped."
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(stats.snapshot(top=options["top"]), indent=2))
+        if options["reset"]:
+            stats.reset()
@@ -0,0 +1,50 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from authmod.models import Role
+from authmod.roles import BATCH_SIZE, migrate_role, reassign_roles_from_csv
+
+
+class Command(BaseCommand):
+    help = (
+        "Reassign roles in bulk, either every user of one role to another, or "
+        "from a CSV file with the columns 'username' and 'role'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="old_role", help="Name of the old role.")
+        parser.add_argument("--to", dest="new_role", help="Name of the new role.")
+        parser.add_argument("--csv", help="CSV file to read, or - for stdin.")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("The batch size must be positive.")
+        kwargs = {"batch_size": options["batch_size"], "progress": self.progress}
+
+        if options["csv"]:
+            if options["old_role"] or options["new_role"]:
+                raise CommandError("--csv can't be combined with --from and --to.")
+            try:
+                if options["csv"] == "-":
+                    count = reassign_roles_from_csv(sys.stdin, **kwargs)
+                else:
+                    with open(options["csv"], newline="") as f:
+                        count = reassign_roles_from_csv(f, **kwargs)
+            except (KeyError, Role.DoesNotExist) as e:
+                raise CommandError("Invalid CSV file: %s" % e)
+        elif options["old_role"] and options["new_role"]:
+            try:
+                old_role = Role.objects.get(name=options["old_role"])
+                new_role = Role.objects.get(name=options["new_role"])
+            except Role.DoesNotExist:
+                raise CommandError("Unknown role.")
+            count = migrate_role(old_role, new_role, **kwargs)
+        else:
+            raise CommandError("Either --csv or both --from and --to are required.")
+
+        self.stdout.write("%d users reassigned." % count)
+
+    def progress(self, done, total):
+        self.stdout.write("%d/%d" % (done, total))
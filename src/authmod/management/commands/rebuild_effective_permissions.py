@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from authmod.materialize import refresh_effective_permissions
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the effective_user_permission table, e.g. after enabling "
+        "AUTHMOD_MATERIALIZE_PERMISSIONS."
+    )
+
+    def handle(self, *args, **options):
+        refresh_effective_permissions()
+        self.stdout.write("Effective user permissions rebuilt.")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from authmod.hierarchy import refresh_role_closure
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the auth_role_ancestor table from the parents of every role, "
+        "e.g. after editing role parents with raw SQL."
+    )
+
+    def handle(self, *args, **options):
+        refresh_role_closure()
+        self.stdout.write("Role closure rebuilt.")
@@ -0,0 +1,34 @@
+from django.db import models
+from django.db.models.query import ModelIterable
+
+from authmod.models import prefetch_permissions
+
+
+class RolePermissionsQuerySet(models.QuerySet):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._prefetch_permissions = False
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._prefetch_permissions = self._prefetch_permissions
+        return clone
+
+    def _fetch_all(self):
+        fetched = self._result_cache is not None
+        super()._fetch_all()
+        if (
+            self._prefetch_permissions
+            and not fetched
+            and issubclass(self._iterable_class, ModelIterable)
+        ):
+            prefetch_permissions(self._result_cache)
+
+    def prefetch_permissions(self):
+        """
+        Load the permissions of every user of the queryset in bulk when it is
+        evaluated.
+        """
+        clone = self._chain()
+        clone._prefetch_permissions = True
+        return clone
@@ -0,0 +1,75 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+
+from authmod.conf import get_setting
+from authmod.hierarchy import get_descendant_ids
+from authmod.models import EffectiveUserPermission, UserRole
+
+# Number of rows inserted per statement when rebuilding the table.
+BATCH_SIZE = 5000
+
+
+def refresh_effective_permissions(user_ids=None, role_ids=None):
+    """
+    Rebuild the effective permission rows of the users `user_ids` and of the
+    users having one of the roles `role_ids` or a role inheriting from them.
+    Rebuild the whole table when neither is given.
+    """
+    UserModel = get_user_model()
+    multiple_roles = get_setting("MULTIPLE_ROLES")
+    users = UserModel._default_manager.all()
+    if user_ids is not None or role_ids is not None:
+        role_ids = get_descendant_ids(role_ids or ())
+        q = Q(pk__in=user_ids or ()) | Q(role__in=role_ids or ())
+        if multiple_roles and role_ids:
+            q |= Q(pk__in=UserRole.objects.filter(role__in=role_ids).values("user"))
+        users = users.filter(q)
+    users = users.values("pk")
+
+    with transaction.atomic():
+        rows = set(
+            UserModel._default_manager.filter(
+                pk__in=users, role__permissions__isnull=False
+            ).values_list("pk", "role__permissions")
+        )
+        rows.update(
+            UserModel.user_permissions.through.objects.filter(
+                user__in=users
+            ).values_list("user_id", "permission_id")
+        )
+        rows.update(
+            UserModel._default_manager.filter(
+                pk__in=users, role__ancestor_links__ancestor__permissions__isnull=False
+            ).values_list("pk", "role__ancestor_links__ancestor__permissions")
+        )
+        if multiple_roles:
+            rows.update(
+                UserRole.objects.filter(
+                    user__in=users, role__permissions__isnull=False
+                ).values_list("user_id", "role__permissions")
+            )
+            rows.update(
+                UserRole.objects.filter(
+                    user__in=users,
+                    role__ancestor_links__ancestor__permissions__isnull=False,
+                ).values_list("user_id", "role__ancestor_links__ancestor__permissions")
+            )
+
+        EffectiveUserPermission.objects.filter(user__in=users).delete()
+        EffectiveUserPermission.objects.bulk_create(
+            [
+                EffectiveUserPermission(user_id=user_id, permission_id=permission_id)
+                for user_id, permission_id in rows
+            ],
+            batch_size=BATCH_SIZE,
+        )
+
+
+def refresh_materialized(user_ids=None, role_ids=None):
+    """
+    Refresh the effective permission rows of the given users and roles, if
+    AUTHMOD_MATERIALIZE_PERMISSIONS is enabled.
+    """
+    if get_setting("MATERIALIZE_PERMISSIONS") and (user_ids or role_ids):
+        refresh_effective_permissions(user_ids=user_ids, role_ids=role_ids)
@@ -0,0 +1,40 @@
+from django.contrib import auth
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
+
+from authmod import invalidation
+from authmod.snapshot import SNAPSHOT_SESSION_KEY, apply_snapshot, make_snapshot
+
+
+def get_user(request):
+    if not hasattr(request, "_authmod_cached_user"):
+        user = auth.get_user(request)
+        if user.is_authenticated and user.is_active and not user.is_superuser:
+            value = request.session.get(SNAPSHOT_SESSION_KEY)
+            if value is None or not apply_snapshot(user, value):
+                request.session[SNAPSHOT_SESSION_KEY] = make_snapshot(user)
+        request._authmod_cached_user = user
+    return request._authmod_cached_user
+
+
+class PermissionSnapshotMiddleware(MiddlewareMixin):
+    """
+    Replace `request.user` set by AuthenticationMiddleware with a user whose
+    direct permissions are loaded from a signed snapshot kept in the session,
+    so permission checks need no query while the snapshot is up to date.
+    Must come after AuthenticationMiddleware.
+    """
+
+    def process_request(self, request):
+        request.user = SimpleLazyObject(lambda: get_user(request))
+
+
+class InvalidationMiddleware(MiddlewareMixin):
+    """
+    Drop the permission data this process keeps in memory when another
+    process published a change, checking at most once per request. Should
+    come before any middleware checking permissions.
+    """
+
+    def process_request(self, request):
+        invalidation.poll()
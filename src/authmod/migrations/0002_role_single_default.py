@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:58
+
+from django.db import migrations, models
+
+
+def keep_single_default(apps, schema_editor):
+    Role = apps.get_model("authmod", "Role")
+    default = Role.objects.filter(is_default=True).order_by("-pk").first()
+    if default is not None:
+        Role.objects.filter(is_default=True).exclude(pk=default.pk).update(
+            is_default=False
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("authmod", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(keep_single_default, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="role",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("is_default", True)),
+                fields=("is_default",),
+                name="authmod_role_single_default",
+            ),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("authmod", "0002_role_single_default"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EffectiveUserPermission",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "permission",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="auth.permission",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "effective_user_permission",
+                "indexes": [
+                    models.Index(
+                        fields=["permission", "user"],
+                        name="authmod_effective_perm_user",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="effectiveuserpermission",
+            constraint=models.UniqueConstraint(
+                fields=("user", "permission"),
+                name="authmod_effective_user_permission_unique",
+            ),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contenttypes", "0002_remove_content_type_name"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("authmod", "0003_effective_user_permission"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ObjectRole",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "object_id",
+                    models.CharField(
+                        blank=True,
+                        help_text="Leave empty to grant the role over every object of the type.",
+                        max_length=255,
+                        verbose_name="object id",
+                    ),
+                ),
+                (
+                    "content_type",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="contenttypes.contenttype",
+                        verbose_name="content type",
+                    ),
+                ),
+                (
+                    "role",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="object_grants",
+                        to="authmod.role",
+                        verbose_name="role",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="object_roles",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="user",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "auth_object_role",
+                "indexes": [
+                    models.Index(
+                        fields=["content_type", "object_id"],
+                        name="authmod_object_role_object",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="objectrole",
+            constraint=models.UniqueConstraint(
+                fields=("user", "content_type", "object_id", "role"),
+                name="authmod_object_role_unique",
+            ),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("authmod", "0004_object_role"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserRole",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "role",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="+",
+                        to="authmod.role",
+                        verbose_name="role",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="user",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "auth_user_role",
+                "indexes": [
+                    models.Index(fields=["role", "user"], name="authmod_user_role_role")
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="userrole",
+            constraint=models.UniqueConstraint(
+                fields=("user", "role"), name="authmod_user_role_unique"
+            ),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authmod", "0005_user_role"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="role",
+            name="parents",
+            field=models.ManyToManyField(
+                blank=True,
+                help_text="The role inherits all permissions granted to its parents.",
+                related_name="children",
+                to="authmod.role",
+                verbose_name="parent roles",
+            ),
+        ),
+        migrations.CreateModel(
+            name="RoleAncestor",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "ancestor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="descendant_links",
+                        to="authmod.role",
+                    ),
+                ),
+                (
+                    "role",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ancestor_links",
+                        to="authmod.role",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "auth_role_ancestor",
+                "indexes": [
+                    models.Index(
+                        fields=["ancestor", "role"], name="authmod_role_ancestor_desc"
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="roleancestor",
+            constraint=models.UniqueConstraint(
+                fields=("role", "ancestor"), name="authmod_role_ancestor_unique"
+            ),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authmod", "0006_role_ancestor"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InvalidationGeneration",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=100, primary_key=True, serialize=False),
+                ),
+                ("generation", models.BigIntegerField(default=0)),
+            ],
+            options={
+                "db_table": "auth_invalidation_generation",
+            },
+        ),
+    ]
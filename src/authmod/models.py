@@ -1,10 +1,38 @@
+import inspect
+import operator
+from functools import reduce
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import auth
 from django.contrib.auth.models import Permission
+from django.contrib.auth.signals import user_login_failed
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import PermissionDenied
-from django.db import models, transaction
+from django.db import IntegrityError, models, router, transaction
+from django.db.models import Exists, Q
 from django.utils.itercompat import is_iterable
 from django.utils.translation import gettext_lazy as _
 
+from authmod.exceptions import DefaultRoleNotFound
+from authmod.instrumentation import instrument, stats
+
+# How many times Role.save is attempted when it loses a race with another
+# default role being saved.
+DEFAULT_ROLE_SAVE_ATTEMPTS = 3
+
+DEFAULT_ROLE_CONSTRAINT = "authmod_role_single_default"
+
+
+def _is_default_conflict(error):
+    """
+    Return True if the IntegrityError `error` was raised by the constraint
+    allowing a single default role, rather than e.g. by a duplicate name.
+    """
+    # PostgreSQL names the violated constraint, SQLite its column.
+    message = str(error)
+    return DEFAULT_ROLE_CONSTRAINT in message or "auth_role.is_default" in message
+
 
 class Role(models.Model):
     name = models.CharField(_("name"), max_length=150, unique=True)
@@ -14,42 +42,142 @@ class Role(models.Model):
         blank=True,
     )
     is_default = models.BooleanField(default=False)
+    parents = models.ManyToManyField(
+        "self",
+        verbose_name=_("parent roles"),
+        blank=True,
+        symmetrical=False,
+        related_name="children",
+        help_text=_("The role inherits all permissions granted to its parents."),
+    )
 
     class Meta:
         db_table = "auth_role"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["is_default"],
+                condition=Q(is_default=True),
+                name=DEFAULT_ROLE_CONSTRAINT,
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
-    @transaction.atomic
+    def _save_default(self, roles, *args, **kwargs):
+        if self.is_default:
+            roles.filter(is_default=True).exclude(pk=self.pk).update(is_default=False)
+            super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
+            self.is_default = bool(
+                roles.filter(pk=self.pk)
+                .exclude(Exists(roles.filter(is_default=True)))
+                .update(is_default=True)
+            )
+
     def save(self, *args, **kwargs):
         """
-        This method checks if there is any default role available, if not
-        id sets current record as default.
-        Else, if current record is set to default and there is already other
-        record which is set as default, we will turn is_default flag for all
-        other records as False.
+        This method keeps exactly one default role. If current record is set
+        to default, the previous default record is turned off. Else, if there
+        is no default record, current record is set as default.
+        A partial unique constraint rejects a concurrent save which would
+        leave two default records, in which case the save is retried.
         """
-        qs = Role.objects.filter(is_default=True)
+        using = kwargs.get("using") or router.db_for_write(Role, instance=self)
+        roles = Role.objects.using(using)
+        for attempt in range(1, DEFAULT_ROLE_SAVE_ATTEMPTS + 1):
+            try:
+                with transaction.atomic(using=using):
+                    self._save_default(roles, *args, **kwargs)
+                break
+            except IntegrityError as e:
+                if attempt == DEFAULT_ROLE_SAVE_ATTEMPTS or not _is_default_conflict(e):
+                    raise
 
-        if self.pk:
-            qs = qs.exclude(pk=self.pk)
+        if self.is_default or _default_role_id == self.pk:
+            clear_default_role_cache()
+            transaction.on_commit(clear_default_role_cache)
 
-        default_exists = qs.exists()
-        if not default_exists:
-            self.is_default = True
-        elif self.is_default and default_exists:
-            Role.objects.exclude(pk=self.pk).update(is_default=False)
-        super().save(*args, **kwargs)
+
+# The default role changes rarely, but is needed for every user saved without
+# a role, so its id is kept in the process until Role.save changes it.
+_default_role_id = None
+
+
+def get_default_role_id():
+    """
+    Return the id of the role given to users saved without a role.
+    """
+    global _default_role_id
+    if _default_role_id is None:
+        try:
+            _default_role_id = (
+                Role.objects.filter(is_default=True).values_list("pk", flat=True).get()
+            )
+        except Role.DoesNotExist:
+            raise DefaultRoleNotFound("There is no default role.")
+    return _default_role_id
+
+
+def clear_default_role_cache():
+    global _default_role_id
+    _default_role_id = None
+
+
+# Backends are resolved once and kept until AUTHENTICATION_BACKENDS changes,
+# so state memoized on backend instances outlives a single permission check.
+_backends = None
+_backend_methods = {}
+
+
+def _get_backends():
+    global _backends
+    if _backends is None:
+        _backends = tuple(auth.get_backends())
+    return _backends
+
+
+def _get_backend_methods(*names):
+    """
+    Return, for every backend implementing any of `names`, a tuple of its
+    bound methods in the order of `names`, with None for missing ones. The
+    methods are wrapped to record their calls when instrumentation is on.
+    """
+    try:
+        return _backend_methods[names]
+    except KeyError:
+        pass
+
+    def get_method(backend, name):
+        method = getattr(backend, name, None)
+        if method is not None and stats.enabled:
+            method = instrument(backend, name, method)
+        return method
+
+    methods = _backend_methods[names] = tuple(
+        tuple(get_method(backend, name) for name in names)
+        for backend in _get_backends()
+        if any(hasattr(backend, name) for name in names)
+    )
+    return methods
+
+
+def reset_backends():
+    """
+    Forget the resolved backends. Called when AUTHENTICATION_BACKENDS or
+    AUTHMOD_INSTRUMENTATION change.
+    """
+    global _backends
+    _backends = None
+    _backend_methods.clear()
 
 
 # A few helper functions for common logic between User and AnonymousUser.
 def _user_get_permissions(user, obj, from_name):
     permissions = set()
-    name = "get_%s_permissions" % from_name
-    for backend in auth.get_backends():
-        if hasattr(backend, name):
-            permissions.update(getattr(backend, name)(user, obj))
+    for (get_permissions,) in _get_backend_methods("get_%s_permissions" % from_name):
+        permissions.update(get_permissions(user, obj))
     return permissions
 
 
@@ -57,32 +185,203 @@ def _user_has_perm(user, perm, obj):
     """
     A backend can raise `PermissionDenied` to short-circuit permission checking.
     """
-    for backend in auth.get_backends():
-        if not hasattr(backend, "has_perm"):
-            continue
+    for (has_perm,) in _get_backend_methods("has_perm"):
         try:
-            if backend.has_perm(user, perm, obj):
+            if has_perm(user, perm, obj):
                 return True
         except PermissionDenied:
             return False
     return False
 
 
+def _user_has_perms(user, perm_list, obj):
+    """
+    Check all permissions of `perm_list` in one pass over the backends. Each
+    backend is only asked for the permissions no earlier backend granted, and
+    a backend raising `PermissionDenied` short-circuits the whole check.
+    """
+    pending = list(perm_list)
+    for has_perms, has_perm in _get_backend_methods("has_perms", "has_perm"):
+        if not pending:
+            break
+        try:
+            if has_perms is not None and has_perms(user, pending, obj):
+                return True
+            if has_perm is not None:
+                pending = [perm for perm in pending if not has_perm(user, perm, obj)]
+        except PermissionDenied:
+            return False
+    return not pending
+
+
 def _user_has_module_perms(user, app_label):
     """
     A backend can raise `PermissionDenied` to short-circuit permission checking.
     """
-    for backend in auth.get_backends():
-        if not hasattr(backend, "has_module_perms"):
-            continue
+    for (has_module_perms,) in _get_backend_methods("has_module_perms"):
         try:
-            if backend.has_module_perms(user, app_label):
+            if has_module_perms(user, app_label):
                 return True
         except PermissionDenied:
             return False
     return False
 
 
+async def _auser_get_permissions(user, obj, from_name):
+    permissions = set()
+    for aget_permissions, get_permissions in _get_backend_methods(
+        "aget_%s_permissions" % from_name, "get_%s_permissions" % from_name
+    ):
+        if aget_permissions is not None:
+            permissions.update(await aget_permissions(user, obj))
+        else:
+            permissions.update(await sync_to_async(get_permissions)(user, obj))
+    return permissions
+
+
+async def _auser_has_perm(user, perm, obj):
+    """
+    See _user_has_perm(). Backends without async methods run in a thread.
+    """
+    for ahas_perm, has_perm in _get_backend_methods("ahas_perm", "has_perm"):
+        try:
+            if ahas_perm is not None:
+                if await ahas_perm(user, perm, obj):
+                    return True
+            elif await sync_to_async(has_perm)(user, perm, obj):
+                return True
+        except PermissionDenied:
+            return False
+    return False
+
+
+async def _auser_has_perms(user, perm_list, obj):
+    """
+    See _user_has_perms(). Backends without async methods run in a thread.
+    """
+    pending = list(perm_list)
+    for ahas_perms, ahas_perm, has_perm in _get_backend_methods(
+        "ahas_perms", "ahas_perm", "has_perm"
+    ):
+        if not pending:
+            break
+        try:
+            if ahas_perms is not None and await ahas_perms(user, pending, obj):
+                return True
+            if ahas_perm is not None:
+                pending = [
+                    perm for perm in pending if not await ahas_perm(user, perm, obj)
+                ]
+            elif has_perm is not None:
+                pending = await sync_to_async(
+                    lambda: [perm for perm in pending if not has_perm(user, perm, obj)]
+                )()
+        except PermissionDenied:
+            return False
+    return not pending
+
+
+async def _auser_has_module_perms(user, app_label):
+    """
+    See _user_has_module_perms(). Backends without async methods run in a
+    thread.
+    """
+    for ahas_module_perms, has_module_perms in _get_backend_methods(
+        "ahas_module_perms", "has_module_perms"
+    ):
+        try:
+            if ahas_module_perms is not None:
+                if await ahas_module_perms(user, app_label):
+                    return True
+            elif await sync_to_async(has_module_perms)(user, app_label):
+                return True
+        except PermissionDenied:
+            return False
+    return False
+
+
+def check_perms_many(users, perm_list, obj=None):
+    """
+    Return a matrix with one row per user of `users` and one column per
+    permission of `perm_list`, telling whether the user has the permission.
+    The permissions of all users are prefetched together, so a row granting
+    every permission is answered by a single has_perms() check.
+    """
+    if not is_iterable(perm_list) or isinstance(perm_list, str):
+        raise ValueError("perm_list must be an iterable of permissions.")
+    perm_list = list(perm_list)
+    users = list(users)
+    prefetch_permissions(users)
+
+    matrix = []
+    for user in users:
+        if (user.is_active and user.is_superuser) or _user_has_perms(
+            user, perm_list, obj
+        ):
+            matrix.append([True] * len(perm_list))
+        else:
+            matrix.append([_user_has_perm(user, perm, obj) for perm in perm_list])
+    return matrix
+
+
+def filter_authorized(user, perm, queryset):
+    """
+    Return the objects of `queryset` on which `user` has the permission
+    `perm`, as a single query. Objects authorized by any backend are kept.
+    """
+    if user.is_active and user.is_superuser:
+        return queryset
+    querysets = [
+        backend_filter(user, perm, queryset)
+        for (backend_filter,) in _get_backend_methods("filter_authorized")
+    ]
+    if not querysets:
+        return queryset.none()
+    return reduce(operator.or_, querysets)
+
+
+def prefetch_permissions(users):
+    """
+    Let every backend supporting it load the permissions of all `users` in
+    bulk, instead of once per user on their first permission check.
+    """
+    for (prefetch,) in _get_backend_methods("prefetch_permissions"):
+        prefetch(users)
+
+
+async def aauthenticate(request=None, **credentials):
+    """
+    Async version of django.contrib.auth.authenticate(), which Django 4.2
+    lacks. Backends implementing aauthenticate() are awaited, so password
+    hashing doesn't block the event loop; the others run in a thread.
+    """
+    for backend, backend_path in auth._get_backends(return_tuples=True):
+        try:
+            inspect.signature(backend.authenticate).bind(request, **credentials)
+        except TypeError:
+            # This backend doesn't accept these credentials as arguments.
+            continue
+        try:
+            if hasattr(backend, "aauthenticate"):
+                user = await backend.aauthenticate(request, **credentials)
+            else:
+                user = await sync_to_async(backend.authenticate)(request, **credentials)
+        except PermissionDenied:
+            # This backend says to stop in our tracks - this user should not
+            # be allowed in at all.
+            break
+        if user is None:
+            continue
+        user.backend = backend_path
+        return user
+
+    await sync_to_async(user_login_failed.send)(
+        sender=__name__,
+        credentials=auth._clean_credentials(credentials),
+        request=request,
+    )
+
+
 class PermissionsMixin(models.Model):
     """
     Add the fields and methods necessary to support the Group and Permission
@@ -117,9 +416,17 @@ class PermissionsMixin(models.Model):
         """
         return _user_get_permissions(self, obj, "user")
 
+    async def aget_user_permissions(self, obj=None):
+        """See get_user_permissions()"""
+        return await _auser_get_permissions(self, obj, "user")
+
     def get_all_permissions(self, obj=None):
         return _user_get_permissions(self, obj, "all")
 
+    async def aget_all_permissions(self, obj=None):
+        """See get_all_permissions()"""
+        return await _auser_get_permissions(self, obj, "all")
+
     def has_perm(self, perm, obj=None):
         """
         Return True if the user has the specified permission. Query all
@@ -134,6 +441,14 @@ class PermissionsMixin(models.Model):
 
         return _user_has_perm(self, perm, obj)
 
+    async def ahas_perm(self, perm, obj=None):
+        """See has_perm()"""
+        # Active superusers have all permissions.
+        if self.is_active and self.is_superuser:
+            return True
+
+        return await _auser_has_perm(self, perm, obj)
+
     def has_perms(self, perm_list, obj=None):
         """
         Return True if the user has each of the specified permissions. If
@@ -141,7 +456,19 @@ class PermissionsMixin(models.Model):
         """
         if not is_iterable(perm_list) or isinstance(perm_list, str):
             raise ValueError("perm_list must be an iterable of permissions.")
-        return all(self.has_perm(perm, obj) for perm in perm_list)
+        # Active superusers have all permissions.
+        if self.is_active and self.is_superuser:
+            return True
+        return _user_has_perms(self, perm_list, obj)
+
+    async def ahas_perms(self, perm_list, obj=None):
+        """See has_perms()"""
+        if not is_iterable(perm_list) or isinstance(perm_list, str):
+            raise ValueError("perm_list must be an iterable of permissions.")
+        # Active superusers have all permissions.
+        if self.is_active and self.is_superuser:
+            return True
+        return await _auser_has_perms(self, perm_list, obj)
 
     def has_module_perms(self, app_label):
         """
@@ -153,13 +480,12 @@ class PermissionsMixin(models.Model):
             return True
         return _user_has_module_perms(self, app_label)
 
-
-def _get_default_role():
-    try:
-        role = Role.objects.filter(is_default=True).get()
-    except Role.DoesNotExist:
-        raise "DefaultRoleNotFound"
-    return role
+    async def ahas_module_perms(self, app_label):
+        """See has_module_perms()"""
+        # Active superusers have all permissions.
+        if self.is_active and self.is_superuser:
+            return True
+        return await _auser_has_module_perms(self, app_label)
 
 
 class RolePermissionsMixin(PermissionsMixin):
@@ -174,6 +500,17 @@ class RolePermissionsMixin(PermissionsMixin):
         on_delete=models.PROTECT,
         null=True,
     )
+    roles = models.ManyToManyField(
+        Role,
+        verbose_name=_("additional roles"),
+        blank=True,
+        help_text=_(
+            "Roles the user has besides their main role, used when "
+            "AUTHMOD_MULTIPLE_ROLES is enabled."
+        ),
+        through="authmod.UserRole",
+        related_name="+",
+    )
 
     class Meta:
         abstract = True
@@ -181,12 +518,186 @@ class RolePermissionsMixin(PermissionsMixin):
     def get_role_permissions(self, obj=None):
         """
         Return a list of permission strings that this user has through their
-        role. Query all available auth backends. If an object is passed in,
+        roles. Query all available auth backends. If an object is passed in,
         return only permissions matching this object.
         """
         return _user_get_permissions(self, obj, "role")
 
+    async def aget_role_permissions(self, obj=None):
+        """See get_role_permissions()"""
+        return await _auser_get_permissions(self, obj, "role")
+
     def save(self, *args, **kwargs):
-        if not self.role and not self.is_superuser:
-            self.role = _get_default_role()
+        if self.role_id is None and not self.is_superuser:
+            self.role_id = get_default_role_id()
         super().save(*args, **kwargs)
+
+
+class EffectiveUserPermission(models.Model):
+    """
+    A permission a user has, either directly or through their role. Rows are
+    kept up to date by signals when AUTHMOD_MATERIALIZE_PERMISSIONS is
+    enabled, so `with_perm` can find users with a single indexed lookup.
+    """
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+    permission = models.ForeignKey(
+        Permission,
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+
+    class Meta:
+        db_table = "effective_user_permission"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "permission"],
+                name="authmod_effective_user_permission_unique",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["permission", "user"],
+                name="authmod_effective_perm_user",
+            ),
+        ]
+
+
+class RoleAncestor(models.Model):
+    """
+    A role and one of the roles it inherits from, directly or through other
+    roles. The transitive closure of `Role.parents`, kept up to date by
+    signals, so inherited permissions are loaded with a single join whatever
+    the depth of the hierarchy.
+    """
+
+    role = models.ForeignKey(
+        Role,
+        on_delete=models.CASCADE,
+        related_name="ancestor_links",
+    )
+    ancestor = models.ForeignKey(
+        Role,
+        on_delete=models.CASCADE,
+        related_name="descendant_links",
+    )
+
+    class Meta:
+        db_table = "auth_role_ancestor"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["role", "ancestor"],
+                name="authmod_role_ancestor_unique",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["ancestor", "role"],
+                name="authmod_role_ancestor_desc",
+            ),
+        ]
+
+
+class UserRole(models.Model):
+    """
+    An additional role of a user. With AUTHMOD_MULTIPLE_ROLES enabled, the
+    user gets the permissions of all their roles.
+    """
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        verbose_name=_("user"),
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+    role = models.ForeignKey(
+        Role,
+        verbose_name=_("role"),
+        on_delete=models.PROTECT,
+        related_name="+",
+    )
+
+    class Meta:
+        db_table = "auth_user_role"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "role"],
+                name="authmod_user_role_unique",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["role", "user"],
+                name="authmod_user_role_role",
+            ),
+        ]
+
+    def __str__(self):
+        return "%s: %s" % (self.user, self.role)
+
+
+class ObjectRole(models.Model):
+    """
+    A role a user holds over a single object, or over every object of a
+    content type when `object_id` is empty. The user gets the permissions of
+    the role for those objects only.
+    """
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        verbose_name=_("user"),
+        on_delete=models.CASCADE,
+        related_name="object_roles",
+    )
+    role = models.ForeignKey(
+        Role,
+        verbose_name=_("role"),
+        on_delete=models.CASCADE,
+        related_name="object_grants",
+    )
+    content_type = models.ForeignKey(
+        ContentType,
+        verbose_name=_("content type"),
+        on_delete=models.CASCADE,
+    )
+    object_id = models.CharField(
+        _("object id"),
+        max_length=255,
+        blank=True,
+        help_text=_("Leave empty to grant the role over every object of the type."),
+    )
+
+    class Meta:
+        db_table = "auth_object_role"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "content_type", "object_id", "role"],
+                name="authmod_object_role_unique",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["content_type", "object_id"],
+                name="authmod_object_role_object",
+            ),
+        ]
+
+    def __str__(self):
+        return "%s: %s" % (self.user, self.role)
+
+
+class InvalidationGeneration(models.Model):
+    """
+    A counter incremented every time permission data changes, polled by the
+    processes of every node to know when their local caches are stale.
+    """
+
+    name = models.CharField(max_length=100, primary_key=True)
+    generation = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = "auth_invalidation_generation"
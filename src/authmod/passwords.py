@@ -0,0 +1,233 @@
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import (
+    check_password,
+    get_hasher,
+    identify_hasher,
+    make_password,
+)
+from django.core.cache import caches
+from django.db import connections
+from django.db.models import Case, F, Value, When
+from django.utils.crypto import get_random_string
+
+from authmod.conf import get_setting
+
+# Number of passwords sent to a worker process at once.
+HASH_CHUNK_SIZE = 16
+
+# Users whose password hash is upgraded by a single statement.
+REHASH_BATCH_SIZE = 500
+
+# Most hashes kept in memory waiting to be stored. Logins needing an upgrade
+# once the queue is full keep their outdated hash, which is upgraded on a
+# later login.
+REHASH_QUEUE_SIZE = 1000
+
+# Outdated and upgraded hashes of a user whose upgrade is not stored yet.
+REHASH_KEY = "authmod:rehash:%s"
+
+
+def get_hashing_executor(workers=None):
+    """
+    Return a process pool for hashing passwords, or None when `workers` is 0.
+    PBKDF2 holds the GIL for most of its work, so a thread pool would not hash
+    passwords in parallel.
+    """
+    if workers == 0:
+        return None
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def hash_passwords(passwords, executor=None):
+    """
+    Return the hashes of the raw `passwords`, computed with `executor` when
+    given and in the current process otherwise.
+    """
+    passwords = list(passwords)
+    if executor is None or len(passwords) < 2:
+        return [make_password(password) for password in passwords]
+    return list(executor.map(make_password, passwords, chunksize=HASH_CHUNK_SIZE))
+
+
+_auth_executor = None
+_auth_executor_lock = threading.Lock()
+
+
+def get_authentication_executor():
+    """
+    Return the process pool shared by authentications of this process, sized
+    by AUTHMOD_AUTHENTICATION_WORKERS, or None to hash in the calling thread.
+    """
+    global _auth_executor
+    workers = get_setting("AUTHENTICATION_WORKERS")
+    if workers == 0:
+        return None
+    with _auth_executor_lock:
+        if _auth_executor is None:
+            _auth_executor = get_hashing_executor(workers)
+        return _auth_executor
+
+
+def verify_password(password, encoded):
+    """
+    Return True if the raw `password` matches the hash `encoded`, hashing in
+    the authentication pool. At most as many passwords as the pool has
+    workers are hashed at once, however many threads authenticate.
+    """
+    executor = get_authentication_executor()
+    if executor is None:
+        return check_password(password, encoded)
+    return executor.submit(check_password, password, encoded).result()
+
+
+async def averify_password(password, encoded):
+    """
+    See verify_password(). The event loop keeps running while the password
+    is hashed.
+    """
+    executor = get_authentication_executor()
+    if executor is None:
+        return check_password(password, encoded)
+    return await asyncio.wrap_future(executor.submit(check_password, password, encoded))
+
+
+def rehash_password(password):
+    """
+    Return a hash of the raw `password` made by the preferred hasher, hashing
+    in the authentication pool.
+    """
+    executor = get_authentication_executor()
+    if executor is None:
+        return make_password(password)
+    return executor.submit(make_password, password).result()
+
+
+async def arehash_password(password):
+    """
+    See rehash_password(). The event loop keeps running while the password
+    is hashed.
+    """
+    executor = get_authentication_executor()
+    if executor is None:
+        return make_password(password)
+    return await asyncio.wrap_future(executor.submit(make_password, password))
+
+
+_dummy_hash = None
+
+
+def get_dummy_hash():
+    """
+    Return a hash made with the default hasher, checked against when there is
+    no such user so unknown and known emails take the same time.
+    """
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = make_password(get_random_string(32))
+    return _dummy_hash
+
+
+def must_update(encoded):
+    """
+    Return True if the hash `encoded` wasn't made by the preferred hasher or
+    with its current parameters.
+    """
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False
+    return hasher.algorithm != get_hasher().algorithm or hasher.must_update(encoded)
+
+
+_pending_rehashes = {}
+_rehash_lock = threading.Lock()
+_rehash_timer = None
+
+
+def _get_cache():
+    return caches[get_setting("CACHE_ALIAS")]
+
+
+def schedule_rehash(user_id, encoded, new_encoded):
+    """
+    Replace the outdated hash `encoded` of the user `user_id` by `new_encoded`
+    in the background, together with the other hashes scheduled meanwhile,
+    instead of on the request which made it. Return False if the queue is
+    full and the upgrade was not scheduled.
+
+    Until it is stored, get_pending_hash() returns the upgraded hash, so a
+    session verified against it stays valid before and after the upgrade.
+    """
+    global _rehash_timer
+    with _rehash_lock:
+        if (
+            user_id not in _pending_rehashes
+            and len(_pending_rehashes) >= REHASH_QUEUE_SIZE
+        ):
+            return False
+        _pending_rehashes[user_id] = (encoded, new_encoded)
+        # Shared with the other processes, which load the outdated hash from
+        # the database until the batch is flushed.
+        _get_cache().set(REHASH_KEY % user_id, (encoded, new_encoded), None)
+        if _rehash_timer is None:
+            _rehash_timer = threading.Timer(
+                get_setting("REHASH_DELAY"), _flush_in_background
+            )
+            _rehash_timer.daemon = True
+            _rehash_timer.start()
+    return True
+
+
+def get_pending_hash(user_id, encoded):
+    """
+    Return the upgraded hash scheduled to replace the hash `encoded` of the
+    user `user_id`, or `encoded` if there is none.
+    """
+    with _rehash_lock:
+        pending = _pending_rehashes.get(user_id)
+    if pending is None:
+        pending = _get_cache().get(REHASH_KEY % user_id)
+    if pending is not None and pending[0] == encoded:
+        return pending[1]
+    return encoded
+
+
+def _flush_in_background():
+    try:
+        flush_rehashes()
+    finally:
+        connections.close_all()
+
+
+def flush_rehashes():
+    """
+    Store the upgraded hashes scheduled so far in batches. A hash which
+    changed since it was scheduled is left untouched.
+    """
+    global _rehash_timer
+    with _rehash_lock:
+        pending = list(_pending_rehashes.items())
+        _pending_rehashes.clear()
+        timer, _rehash_timer = _rehash_timer, None
+    if timer is not None:
+        timer.cancel()
+    if not pending:
+        return
+
+    users = get_user_model()._default_manager
+    for start in range(0, len(pending), REHASH_BATCH_SIZE):
+        batch = pending[start : start + REHASH_BATCH_SIZE]
+        users.filter(pk__in=[user_id for user_id, _ in batch]).update(
+            password=Case(
+                *[
+                    When(pk=user_id, password=encoded, then=Value(new_encoded))
+                    for user_id, (encoded, new_encoded) in batch
+                ],
+                default=F("password"),
+            )
+        )
+    _get_cache().delete_many([REHASH_KEY % user_id for user_id, _ in pending])
@@ -0,0 +1,278 @@
+import threading
+import time
+
+from django.contrib.auth.models import Permission
+
+from authmod.cache import LRUCache, get_role_permissions
+from authmod.conf import get_setting
+
+
+class PermissionRegistry:
+    """
+    Give every permission a dense integer index, so a set of permissions can
+    be stored as an int bitset and checked with bit operations.
+
+    Indexes are only ever added: a reload keeps the index of every permission
+    which still exists, so masks built before the reload stay valid.
+    """
+
+    # Minimum number of seconds between two reloads caused by a permission
+    # string missing from the registry, so checking a permission which
+    # doesn't exist doesn't query the database every time.
+    MISS_RELOAD_INTERVAL = 1
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._loaded_at = 0
+        self._names = []
+        self._index = {}
+        self._pk_index = {}
+        self._resolved = {}
+        self._app_masks = {}
+        self._all_mask = 0
+        self._role_masks = {}
+        # Bits never change meaning, so the app labels of a bitset never
+        # expire.
+        self._app_labels = LRUCache(
+            get_setting("LOCAL_ROLE_CACHE_SIZE"), ttl=float("inf")
+        )
+
+    def invalidate(self):
+        """
+        Reload the permission table the next time it is used.
+        """
+        self._loaded = False
+
+    def clear(self):
+        """
+        Like invalidate(), and also forget the memoized bitsets of roles and
+        app labels of bitsets.
+        """
+        with self._lock:
+            self._role_masks = {}
+            self._app_labels.clear()
+            self._loaded = False
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.reload()
+
+    async def aensure_loaded(self):
+        if not self._loaded:
+            await self.areload()
+
+    def _get_permissions(self):
+        return Permission.objects.values_list(
+            "pk", "content_type__app_label", "codename", "content_type_id"
+        ).order_by("pk")
+
+    def reload(self):
+        self._build(list(self._get_permissions()))
+
+    async def areload(self):
+        self._build([row async for row in self._get_permissions()])
+
+    def _build(self, perms):
+        with self._lock:
+            names = list(self._names)
+            index = dict(self._index)
+            pk_index = {}
+            resolved = {}
+            app_masks = {}
+            all_mask = 0
+
+            for pk, app_label, codename, content_type_id in perms:
+                name = "%s.%s" % (app_label, codename)
+                bit = index.get(name)
+                if bit is None:
+                    bit = index[name] = len(names)
+                    names.append(name)
+                pk_index[pk] = bit
+                resolved[name] = (pk, content_type_id)
+                app_masks[app_label] = app_masks.get(app_label, 0) | 1 << bit
+                all_mask |= 1 << bit
+
+            self._names = names
+            self._index = index
+            self._pk_index = pk_index
+            self._resolved = resolved
+            self._app_masks = app_masks
+            self._all_mask = all_mask
+            self._loaded = True
+            self._loaded_at = time.monotonic()
+
+    @property
+    def all_mask(self):
+        self._ensure_loaded()
+        return self._all_mask
+
+    async def aall_mask(self):
+        await self.aensure_loaded()
+        return self._all_mask
+
+    def _should_reload(self):
+        return time.monotonic() - self._loaded_at >= self.MISS_RELOAD_INTERVAL
+
+    def _get(self, index_name, key):
+        self._ensure_loaded()
+        value = getattr(self, index_name).get(key)
+        if value is None and self._should_reload():
+            # The permission may have been created by another process since
+            # the table was loaded.
+            self.reload()
+            value = getattr(self, index_name).get(key)
+        return value
+
+    async def _aget(self, index_name, key):
+        await self.aensure_loaded()
+        value = getattr(self, index_name).get(key)
+        if value is None and self._should_reload():
+            await self.areload()
+            value = getattr(self, index_name).get(key)
+        return value
+
+    def bit(self, perm):
+        """
+        Return the index of the permission string `perm`, or None if there is
+        no such permission.
+        """
+        return self._get("_index", perm)
+
+    async def abit(self, perm):
+        return await self._aget("_index", perm)
+
+    def resolve(self, perm):
+        """
+        Return the primary key and the content type id of the permission
+        string `perm`, or None if there is no such permission.
+        """
+        return self._get("_resolved", perm)
+
+    async def aresolve(self, perm):
+        return await self._aget("_resolved", perm)
+
+    def app_mask(self, app_label):
+        self._ensure_loaded()
+        return self._app_masks.get(app_label, 0)
+
+    async def aapp_mask(self, app_label):
+        await self.aensure_loaded()
+        return self._app_masks.get(app_label, 0)
+
+    def app_labels(self, mask):
+        """
+        Return the frozenset of app labels of the permissions in the bitset
+        `mask`. Every user with the same permissions shares one frozenset.
+        """
+        labels = self._app_labels.get(mask)
+        if labels is None:
+            labels = frozenset(perm.partition(".")[0] for perm in self.decode(mask))
+            self._app_labels.set(mask, labels)
+        return labels
+
+    def _lookup(self, keys, index_name):
+        index = getattr(self, index_name)
+        mask = 0
+        missing = []
+        for key in keys:
+            bit = index.get(key)
+            if bit is None:
+                missing.append(key)
+            else:
+                mask |= 1 << bit
+        return mask, missing
+
+    def _compile(self, keys, index_name):
+        # Return the bitset of `keys`, and whether all of them were found.
+        self._ensure_loaded()
+        mask, missing = self._lookup(keys, index_name)
+        if missing and self._should_reload():
+            # Permissions read from the database may have been created by
+            # another process since the table was loaded.
+            self.reload()
+            mask_missing, missing = self._lookup(missing, index_name)
+            mask |= mask_missing
+        return mask, not missing
+
+    async def _acompile(self, keys, index_name):
+        await self.aensure_loaded()
+        mask, missing = self._lookup(keys, index_name)
+        if missing and self._should_reload():
+            await self.areload()
+            mask_missing, missing = self._lookup(missing, index_name)
+            mask |= mask_missing
+        return mask, not missing
+
+    def mask(self, perms):
+        """
+        Return the bitset of the given permission strings, which are expected
+        to exist in the database.
+        """
+        return self._compile(perms, "_index")[0]
+
+    async def amask(self, perms):
+        return (await self._acompile(perms, "_index"))[0]
+
+    def mask_from_pks(self, pks):
+        """
+        Return the bitset of the permissions with the given primary keys.
+        """
+        return self._compile(pks, "_pk_index")[0]
+
+    async def amask_from_pks(self, pks):
+        return (await self._acompile(pks, "_pk_index"))[0]
+
+    def has_pks(self, pks):
+        """
+        Return True if every primary key of `pks` belongs to a permission of
+        the registry.
+        """
+        self._ensure_loaded()
+        return not self._lookup(pks, "_pk_index")[1]
+
+    def decode(self, mask):
+        """
+        Return the set of permission strings stored in the bitset `mask`.
+        """
+        names = self._names
+        perms = set()
+        while mask:
+            low = mask & -mask
+            perms.add(names[low.bit_length() - 1])
+            mask ^= low
+        return perms
+
+    def role_mask(self, role_id):
+        """
+        Return the bitset of the permissions granted to the role `role_id`.
+        The bitset is rebuilt only when the cached role permissions change.
+        """
+        return self.role_mask_from(role_id, get_role_permissions(role_id))
+
+    def role_mask_from(self, role_id, perms):
+        """
+        Return the bitset of the role `role_id` whose permission strings
+        `perms` were already fetched.
+        """
+        entry = self._role_masks.get(role_id)
+        if entry is None or (entry[0] is not perms and entry[0] != perms):
+            mask, complete = self._compile(perms, "_index")
+            if not complete:
+                # Not memoized, so the missing permissions are looked up
+                # again once the registry may reload.
+                return mask
+            entry = self._role_masks[role_id] = (perms, mask)
+        return entry[1]
+
+    async def arole_mask_from(self, role_id, perms):
+        entry = self._role_masks.get(role_id)
+        if entry is None or (entry[0] is not perms and entry[0] != perms):
+            mask, complete = await self._acompile(perms, "_index")
+            if not complete:
+                return mask
+            entry = self._role_masks[role_id] = (perms, mask)
+        return entry[1]
+
+
+registry = PermissionRegistry()
@@ -0,0 +1,175 @@
+import csv
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.db import connection, transaction
+
+from authmod.materialize import refresh_materialized
+from authmod.models import Role, get_default_role_id
+from authmod.registry import registry
+from authmod.signals import invalidate_roles, invalidate_users
+
+# Number of users updated per statement, each in its own transaction, so the
+# user table is never locked for long.
+BATCH_SIZE = 1000
+
+
+def _get_role_id(role):
+    if role is None:
+        return get_default_role_id()
+    return role.pk if isinstance(role, Role) else role
+
+
+def _reassign(user_ids, role_id, batch_size, progress, done=0, total=None):
+    UserModel = get_user_model()
+    total = len(user_ids) if total is None else total
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start : start + batch_size]
+        with transaction.atomic():
+            UserModel._default_manager.filter(pk__in=batch).update(role=role_id)
+            invalidate_users(batch)
+            refresh_materialized(user_ids=batch)
+        done += len(batch)
+        if progress is not None:
+            progress(done, total)
+    return done
+
+
+def reassign_roles(users, role, batch_size=BATCH_SIZE, progress=None):
+    """
+    Give the role `role` to the users of the queryset `users` with chunked
+    UPDATEs, skipping `save()` and its signals. `role` is a role or its id,
+    or None for the default role. `progress` is called with the number of
+    users updated so far and the total after every chunk. Return the number
+    of users updated.
+
+    The permissions of a role don't depend on who holds it, so only the
+    versions of the updated users are bumped.
+    """
+    role_id = _get_role_id(role)
+    user_ids = list(
+        users.exclude(role=role_id).order_by("pk").values_list("pk", flat=True)
+    )
+    return _reassign(user_ids, role_id, batch_size, progress)
+
+
+def migrate_role(old_role, new_role, batch_size=BATCH_SIZE, progress=None):
+    """
+    Move every user of the role `old_role` to the role `new_role`. See
+    reassign_roles().
+    """
+    users = get_user_model()._default_manager.filter(role=_get_role_id(old_role))
+    return reassign_roles(users, new_role, batch_size=batch_size, progress=progress)
+
+
+def reassign_roles_from_csv(stream, batch_size=BATCH_SIZE, progress=None):
+    """
+    Reassign roles from the CSV file object `stream`, whose rows hold the
+    username of a user and the name of their new role, with a header row
+    naming the columns "username" and "role". See reassign_roles().
+
+    Raise Role.DoesNotExist if a role is unknown, before any user is updated.
+    Unknown usernames are ignored.
+    """
+    UserModel = get_user_model()
+    usernames = defaultdict(list)
+    for row in csv.DictReader(stream):
+        usernames[row["role"]].append(row["username"])
+
+    role_ids = dict(Role.objects.filter(name__in=usernames).values_list("name", "pk"))
+    unknown = set(usernames) - set(role_ids)
+    if unknown:
+        raise Role.DoesNotExist("Unknown roles: %s." % ", ".join(sorted(unknown)))
+
+    assignments = []
+    for name, names in usernames.items():
+        users = UserModel._default_manager.filter(
+            **{"%s__in" % UserModel.USERNAME_FIELD: names}
+        ).exclude(role=role_ids[name])
+        assignments.append(
+            (role_ids[name], list(users.order_by("pk").values_list("pk", flat=True)))
+        )
+
+    done, total = 0, sum(len(user_ids) for _, user_ids in assignments)
+    for role_id, user_ids in assignments:
+        done = _reassign(user_ids, role_id, batch_size, progress, done, total)
+    return done
+
+
+def _resolve_permissions(perms):
+    pks = {}
+    for perm in perms:
+        resolved = registry.resolve(perm)
+        if resolved is None:
+            # The permission may have been created by another process.
+            registry.reload()
+            resolved = registry.resolve(perm)
+            if resolved is None:
+                raise Permission.DoesNotExist("Unknown permission: %s." % perm)
+        pks[perm] = resolved[0]
+    return pks
+
+
+def _get_sync_sql(model):
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    columns = (
+        quote_name(model._meta.get_field("role").column),
+        quote_name(model._meta.get_field("permission").column),
+    )
+    insert = "INSERT INTO %s (%s, %s) VALUES (%%s, %%s)" % (table, *columns)
+    delete = "DELETE FROM %s WHERE %s = %%s AND %s = %%s" % (table, *columns)
+    return insert, delete
+
+
+def sync_role_permissions(policy):
+    """
+    Make the permissions of roles match `policy`, a dict mapping role names
+    to lists of permission strings. Roles missing from `policy` are left
+    alone.
+
+    The current permissions of every role are read with one query, and only
+    the difference is written with bulk deletes and inserts, in a single
+    transaction and without m2m_changed signals. The changed roles are
+    invalidated once. Return the numbers of permissions granted and revoked.
+
+    Raise Role.DoesNotExist or Permission.DoesNotExist if a role or a
+    permission is unknown, before anything is written.
+    """
+    role_ids = dict(Role.objects.filter(name__in=policy).values_list("name", "pk"))
+    unknown = set(policy) - set(role_ids)
+    if unknown:
+        raise Role.DoesNotExist("Unknown roles: %s." % ", ".join(sorted(unknown)))
+    pks = _resolve_permissions({perm for perms in policy.values() for perm in perms})
+
+    RolePermission = Role.permissions.through
+    with transaction.atomic():
+        current = defaultdict(set)
+        rows = RolePermission.objects.filter(role__in=role_ids.values())
+        for role_id, permission_id in rows.values_list("role_id", "permission_id"):
+            current[role_id].add(permission_id)
+
+        granted, revoked, changed = [], [], set()
+        for name, perms in policy.items():
+            role_id = role_ids[name]
+            desired = {pks[perm] for perm in perms}
+            added = desired - current[role_id]
+            removed = current[role_id] - desired
+            if added or removed:
+                changed.add(role_id)
+            granted += [(role_id, permission_id) for permission_id in added]
+            revoked += [(role_id, permission_id) for permission_id in removed]
+
+        # Building a model instance or a lookup per row would take most of
+        # the time of a large sync.
+        insert, delete = _get_sync_sql(RolePermission)
+        with connection.cursor() as cursor:
+            if revoked:
+                cursor.executemany(delete, revoked)
+            if granted:
+                cursor.executemany(insert, granted)
+
+        invalidate_roles(changed)
+        refresh_materialized(role_ids=changed)
+    return len(granted), len(revoked)
@@ -0,0 +1,221 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.contrib.auth.signals import user_logged_in
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_migrate,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+
+from authmod import invalidation
+from authmod.cache import bump_role_version, bump_user_version
+from authmod.conf import get_setting
+from authmod.hierarchy import (
+    check_role_cycle,
+    get_descendant_ids,
+    link_roles,
+    refresh_role_closure,
+)
+from authmod.instrumentation import stats
+from authmod.materialize import refresh_materialized
+from authmod.models import Role, UserRole, clear_default_role_cache, reset_backends
+from authmod.registry import registry
+from authmod.snapshot import SNAPSHOT_SESSION_KEY, make_snapshot
+
+UserModel = get_user_model()
+
+SNAPSHOT_MIDDLEWARE = "authmod.middleware.PermissionSnapshotMiddleware"
+
+
+def invalidate_roles(role_ids, descendants=True):
+    """
+    Bump the version of the given roles now, so the current transaction sees
+    its own changes, and again on commit, so other processes can't keep data
+    they cached before the transaction was committed. Roles inheriting from
+    the given roles are invalidated too, unless `descendants` is False.
+    """
+    role_ids = list(get_descendant_ids(role_ids) if descendants else role_ids)
+    if not role_ids:
+        return
+    bump_role_version(*role_ids)
+    transaction.on_commit(lambda: bump_role_version(*role_ids))
+    invalidation.publish(invalidation.ROLE, role_ids)
+
+
+def invalidate_users(user_ids):
+    """
+    Bump the version of the given users, like `invalidate_roles`.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    bump_user_version(*user_ids)
+    transaction.on_commit(lambda: bump_user_version(*user_ids))
+    invalidation.publish(invalidation.USER, user_ids)
+
+
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+def role_changed(sender, instance, **kwargs):
+    # Saving a role doesn't change what its descendants inherit.
+    invalidate_roles([instance.pk], descendants=False)
+
+
+@receiver(pre_delete, sender=Role)
+def role_deleting(sender, instance, **kwargs):
+    instance._authmod_descendant_ids = get_descendant_ids([instance.pk]) - {instance.pk}
+
+
+@receiver(post_delete, sender=Role)
+def role_deleted(sender, instance, **kwargs):
+    if instance.is_default:
+        clear_default_role_cache()
+    # The descendants lost the permissions inherited through the role.
+    descendant_ids = instance.__dict__.pop("_authmod_descendant_ids", set())
+    if descendant_ids:
+        refresh_role_closure(descendant_ids)
+        invalidate_roles(descendant_ids)
+        refresh_materialized(role_ids=descendant_ids)
+
+
+def _get_changed_ids(instance, action, reverse, pk_set, reverse_name):
+    """
+    Return the ids of the objects on the forward side of a many-to-many
+    relation whose related objects changed, or None before the change.
+    """
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            return [instance.pk]
+    elif action == "pre_clear":
+        # The affected objects are gone once the relation is cleared.
+        instance._authmod_cleared_ids = list(
+            getattr(instance, reverse_name).values_list("pk", flat=True)
+        )
+    elif action == "post_clear":
+        return instance.__dict__.pop("_authmod_cleared_ids", [])
+    elif action in ("post_add", "post_remove"):
+        return list(pk_set)
+    return None
+
+
+@receiver(m2m_changed, sender=Role.permissions.through)
+def role_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    role_ids = _get_changed_ids(instance, action, reverse, pk_set, "role_set")
+    if role_ids is not None:
+        invalidate_roles(role_ids)
+        refresh_materialized(role_ids=role_ids)
+
+
+@receiver(m2m_changed, sender=Role.parents.through)
+def role_parents_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_add":
+        if reverse:
+            check_role_cycle(pk_set, [instance.pk])
+        else:
+            check_role_cycle([instance.pk], pk_set)
+        return
+
+    role_ids = _get_changed_ids(instance, action, reverse, pk_set, "children")
+    if role_ids is None:
+        return
+    if action == "post_add":
+        link_roles(role_ids, [instance.pk] if reverse else pk_set)
+    else:
+        refresh_role_closure(role_ids)
+    invalidate_roles(role_ids)
+    refresh_materialized(role_ids=role_ids)
+
+
+@receiver(m2m_changed, sender=UserModel.user_permissions.through)
+def user_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    user_ids = _get_changed_ids(instance, action, reverse, pk_set, "user_set")
+    if user_ids is not None:
+        invalidate_users(user_ids)
+        refresh_materialized(user_ids=user_ids)
+
+
+@receiver(m2m_changed, sender=UserRole)
+def user_roles_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Roles have no reverse accessor to the users, so only the forward side
+    # of the relation can change.
+    user_ids = _get_changed_ids(instance, action, reverse, pk_set, None)
+    if user_ids is not None:
+        invalidate_users(user_ids)
+        refresh_materialized(user_ids=user_ids)
+
+
+@receiver(post_save, sender=UserRole)
+@receiver(post_delete, sender=UserRole)
+def user_role_changed(sender, instance, **kwargs):
+    invalidate_users([instance.user_id])
+    refresh_materialized(user_ids=[instance.user_id])
+
+
+@receiver(post_save, sender=UserModel)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    if created or update_fields is None or "role" in update_fields:
+        refresh_materialized(user_ids=[instance.pk])
+
+
+@receiver(user_logged_in)
+def store_permission_snapshot(sender, request, user, **kwargs):
+    if SNAPSHOT_MIDDLEWARE in settings.MIDDLEWARE and hasattr(request, "session"):
+        request.session[SNAPSHOT_SESSION_KEY] = make_snapshot(user)
+
+
+@receiver(post_save, sender=Permission)
+def permission_changed(sender, instance, created, **kwargs):
+    registry.invalidate()
+    invalidation.publish(invalidation.PERMISSION, [instance.pk])
+    if not created:
+        invalidate_roles(instance.role_set.values_list("pk", flat=True))
+
+
+@receiver(pre_delete, sender=Permission)
+def permission_deleting(sender, instance, **kwargs):
+    instance._authmod_deleted_roles = list(
+        instance.role_set.values_list("pk", flat=True)
+    )
+    # The cascade on the relations sends no m2m_changed signal.
+    instance._authmod_deleted_users = list(
+        instance.user_set.values_list("pk", flat=True)
+    )
+
+
+@receiver(post_delete, sender=Permission)
+def permission_deleted(sender, instance, **kwargs):
+    registry.invalidate()
+    invalidation.publish(invalidation.PERMISSION, [instance.pk])
+    invalidate_roles(instance.__dict__.pop("_authmod_deleted_roles", []))
+    invalidate_users(instance.__dict__.pop("_authmod_deleted_users", []))
+
+
+@receiver(post_migrate)
+def permissions_migrated(sender, **kwargs):
+    # Permissions created by migrate are bulk inserted, without signals.
+    registry.invalidate()
+
+
+@receiver(setting_changed)
+def authentication_backends_changed(setting, **kwargs):
+    if setting == "AUTHENTICATION_BACKENDS":
+        reset_backends()
+
+
+@receiver(setting_changed)
+def instrumentation_changed(setting, **kwargs):
+    if setting == "AUTHMOD_INSTRUMENTATION":
+        stats.enabled = get_setting("INSTRUMENTATION")
+        reset_backends()
+
+
+@receiver(setting_changed)
+def invalidation_transport_changed(setting, **kwargs):
+    if setting == "AUTHMOD_INVALIDATION_TRANSPORT":
+        invalidation.reset_transport()
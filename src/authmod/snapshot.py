@@ -0,0 +1,64 @@
+from django.core import signing
+
+from authmod.cache import get_role_version, get_user_version
+from authmod.conf import get_setting
+from authmod.registry import registry
+
+SNAPSHOT_SESSION_KEY = "_authmod_permissions"
+SNAPSHOT_SALT = "authmod.snapshot"
+
+
+def make_snapshot(user):
+    """
+    Return a signed snapshot of the permissions of `user`: their role and its
+    version, and their direct permissions and additional roles together with
+    the user version.
+    """
+    permission_ids = sorted(user.user_permissions.values_list("pk", flat=True))
+    user._user_perm_mask = registry.mask_from_pks(permission_ids)
+    snapshot = {
+        "u": user.pk,
+        "uv": get_user_version(user.pk),
+        "r": user.role_id,
+        "rv": get_role_version(user.role_id) if user.role_id else None,
+        "p": permission_ids,
+    }
+    if get_setting("MULTIPLE_ROLES"):
+        role_ids = set(user.roles.values_list("pk", flat=True))
+        if user.role_id is not None:
+            role_ids.add(user.role_id)
+        user._role_ids = frozenset(role_ids)
+        snapshot["rs"] = sorted(role_ids)
+    return signing.dumps(
+        snapshot,
+        salt=SNAPSHOT_SALT,
+        compress=True,
+    )
+
+
+def apply_snapshot(user, value):
+    """
+    Load the direct permissions and roles of `user` from the snapshot
+    `value`. Return False if the snapshot is invalid or outdated, in which
+    case nothing is loaded.
+    """
+    try:
+        snapshot = signing.loads(value, salt=SNAPSHOT_SALT)
+    except signing.BadSignature:
+        return False
+
+    if (
+        snapshot["u"] != user.pk
+        or snapshot["r"] != user.role_id
+        or snapshot["uv"] != get_user_version(user.pk)
+        or (user.role_id and snapshot["rv"] != get_role_version(user.role_id))
+        or ("rs" in snapshot) != get_setting("MULTIPLE_ROLES")
+        # A permission of the snapshot was deleted.
+        or not registry.has_pks(snapshot["p"])
+    ):
+        return False
+
+    user._user_perm_mask = registry.mask_from_pks(snapshot["p"])
+    if "rs" in snapshot:
+        user._role_ids = frozenset(snapshot["rs"])
+    return True
@@ -1,11 +1,54 @@
+import json
+from io import StringIO
+from unittest import mock
 from uuid import uuid4
 
+from django.contrib.auth import authenticate
+from django.contrib.auth.backends import BaseBackend
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
-from django.test import TestCase
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from faker import Faker
 
-from authmod.models import Role
+from authmod import invalidation
+from authmod.backends import RoleBasedModelBackend
+from authmod.cache import (
+    LRUCache,
+    bump_role_version,
+    get_user_version,
+    local_role_cache,
+)
+from authmod.exceptions import DefaultRoleNotFound, RoleCycleError
+from authmod.instrumentation import permission_checked, stats
+from authmod.materialize import refresh_effective_permissions
+from authmod.middleware import InvalidationMiddleware, PermissionSnapshotMiddleware
+from authmod.models import (
+    InvalidationGeneration,
+    ObjectRole,
+    Role,
+    _get_backend_methods,
+    _get_backends,
+    _is_default_conflict,
+    aauthenticate,
+    check_perms_many,
+    clear_default_role_cache,
+    filter_authorized,
+)
+from authmod.passwords import flush_rehashes, get_pending_hash, schedule_rehash
+from authmod.registry import registry
+from authmod.roles import (
+    migrate_role,
+    reassign_roles,
+    reassign_roles_from_csv,
+    sync_role_permissions,
+)
+from authmod.signals import permissions_migrated
+from authmod.snapshot import SNAPSHOT_SESSION_KEY
+from users.models import User
 from users.tests import create_test_user
 
 faker = Faker()
@@ -21,6 +64,10 @@ def create_test_permission():
     )
 
 
+def get_perm_str(perm):
+    return f"{perm.content_type.app_label}.{perm.codename}"
+
+
 def create_test_role(**kwargs):
     return Role.objects.create(
         name=faker.user_name(),
@@ -51,6 +98,81 @@ class RoleCreateTestCase(TestCase):
         prev_role.refresh_from_db()
         self.assertFalse(prev_role.is_default)
 
+    def test_keep_default_role(self):
+        """
+        Test if the only default role stays default when it is saved with
+        is_default turned off
+        """
+        role = Role.objects.create(name="DEFAULT")
+        role.is_default = False
+        role.save()
+
+        role.refresh_from_db()
+        self.assertTrue(role.is_default)
+
+    def test_single_default_constraint(self):
+        """
+        Test if the database rejects a second default role
+        """
+        Role.objects.create(name="DEFAULT")
+        with self.assertRaises(IntegrityError) as cm:
+            with transaction.atomic():
+                Role.objects.bulk_create([Role(name="OTHER", is_default=True)])
+        self.assertTrue(_is_default_conflict(cm.exception))
+
+    def test_duplicate_name_not_retried(self):
+        """
+        Test if saving a role with a duplicate name fails without retrying
+        """
+        Role.objects.create(name="DEFAULT")
+        with CaptureQueriesContext(connection) as context:
+            with self.assertRaises(IntegrityError) as cm:
+                with transaction.atomic():
+                    Role.objects.create(name="DEFAULT")
+        inserts = [q for q in context.captured_queries if q["sql"].startswith("INSERT")]
+        self.assertEqual(len(inserts), 1)
+        self.assertFalse(_is_default_conflict(cm.exception))
+
+    def test_save_statements(self):
+        """
+        Test if saving a role costs two statements
+        """
+        Role.objects.create(name="DEFAULT")
+        with CaptureQueriesContext(connection) as context:
+            Role.objects.create(name="NEW", is_default=True)
+
+        statements = [
+            query["sql"]
+            for query in context.captured_queries
+            if "SAVEPOINT" not in query["sql"]
+        ]
+        self.assertEqual(len(statements), 2)
+
+
+class DefaultRoleTestCase(TestCase):
+    def test_default_role_assigned(self):
+        """
+        Test if users saved without a role get the default role, which is
+        looked up once and refreshed when the default role changes
+        """
+        default = Role.objects.create(name="DEFAULT", is_default=True)
+        self.assertEqual(create_test_user().role_id, default.pk)
+
+        with self.assertNumQueries(1):
+            User(email_address=faker.free_email()).save()
+
+        new_default = create_test_role(is_default=True)
+        self.assertEqual(create_test_user().role_id, new_default.pk)
+
+    def test_default_role_not_found(self):
+        """
+        Test if saving a user without a role raises DefaultRoleNotFound
+        when there is no default role
+        """
+        clear_default_role_cache()
+        with self.assertRaises(DefaultRoleNotFound):
+            create_test_user()
+
 
 class RoleBasedAccessTestCase(TestCase):
     def setUp(self):
@@ -161,3 +283,1429 @@ class RoleBasedAccessTestCase(TestCase):
         perm_str2 = self.get_perm_str(perm2)
 
         self.assertSetEqual(allperms, {perm_str1, perm_str2})
+
+
+class RolePermissionCacheTestCase(TestCase):
+    def setUp(self):
+        Role.objects.create(name="DEFAULT", is_default=True)
+
+        self.role = create_test_role()
+        self.perm = create_test_permission()
+        self.role.permissions.add(self.perm)
+        self.user = create_test_user(role=self.role)
+
+    def test_warm_role_costs_no_queries(self):
+        """
+        Test if role permissions of a warm role are served from the cache
+        for a freshly loaded user
+        """
+        self.user.get_role_permissions()
+
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            roleperms = user.get_role_permissions()
+
+        self.assertSetEqual(roleperms, {get_perm_str(self.perm)})
+
+    def test_role_permissions_change_invalidates(self):
+        """
+        Test if adding and removing role permissions from either side of
+        the relation invalidates the cached role permissions
+        """
+        perm = create_test_permission()
+        self.user.get_role_permissions()
+
+        self.role.permissions.add(perm)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertIn(get_perm_str(perm), user.get_role_permissions())
+
+        perm.role_set.remove(self.role)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertNotIn(get_perm_str(perm), user.get_role_permissions())
+
+        self.perm.role_set.clear()
+        user = User.objects.get(pk=self.user.pk)
+        self.assertSetEqual(user.get_role_permissions(), set())
+
+    def test_permission_delete_invalidates(self):
+        """
+        Test if deleting a permission removes it from the cached role
+        permissions
+        """
+        self.user.get_role_permissions()
+
+        self.perm.delete()
+
+        user = User.objects.get(pk=self.user.pk)
+        self.assertSetEqual(user.get_role_permissions(), set())
+
+
+class PermissionRegistryTestCase(TestCase):
+    def test_indexes_survive_reload(self):
+        """
+        Test if a reload keeps the index of existing permissions and adds
+        new ones
+        """
+        perm = create_test_permission()
+        perm_str = get_perm_str(perm)
+        bit = registry.bit(perm_str)
+
+        new_perm = create_test_permission()
+        new_perm_str = get_perm_str(new_perm)
+
+        self.assertEqual(registry.bit(perm_str), bit)
+        self.assertIsNotNone(registry.bit(new_perm_str))
+        self.assertSetEqual(
+            registry.decode(registry.mask([perm_str, new_perm_str])),
+            {perm_str, new_perm_str},
+        )
+
+    def test_permission_created_elsewhere(self):
+        """
+        Test if checking a permission missing from the registry reloads it,
+        at most once per interval
+        """
+        role = create_test_role(is_default=True)
+        role.permissions.add(create_test_permission())
+        user = create_test_user(role=role)
+        self.assertFalse(user.has_perm("authmod.unknown_permission"))
+
+        # Another process creates a permission, without signals here.
+        (perm,) = Permission.objects.bulk_create(
+            [
+                Permission(
+                    name="Test Permission",
+                    codename=str(uuid4()),
+                    content_type=ContentType.objects.get_for_model(Permission),
+                )
+            ]
+        )
+        perm = Permission.objects.get(codename=perm.codename)
+        Role.permissions.through.objects.create(role=role, permission=perm)
+        bump_role_version(role.pk)
+
+        with self.assertNumQueries(0):
+            self.assertFalse(user.has_perm("authmod.unknown_permission"))
+        registry._loaded_at -= registry.MISS_RELOAD_INTERVAL
+        user = User.objects.get(pk=user.pk)
+        self.assertTrue(user.has_perm(get_perm_str(perm)))
+        self.assertTrue(user.has_perms([get_perm_str(perm)]))
+
+    def test_masks_of_users(self):
+        """
+        Test if permission checks of regular users and superusers are
+        answered from their bitsets
+        """
+        Role.objects.create(name="DEFAULT", is_default=True)
+        perm = create_test_permission()
+        perm_str = get_perm_str(perm)
+
+        user = create_test_user()
+        user.user_permissions.add(perm)
+        superuser = create_test_user(is_superuser=True)
+
+        self.assertTrue(user.has_perms([perm_str]))
+        self.assertEqual(user._perm_mask, registry.mask([perm_str]))
+        self.assertFalse(user.has_perm("authmod.unknown_permission"))
+        self.assertIn(perm_str, superuser.get_all_permissions())
+        self.assertTrue(superuser.has_module_perms(perm.content_type.app_label))
+
+    def test_app_labels_shared(self):
+        """
+        Test if users with the same role share one set of app labels, and if
+        module checks need no query once it is built
+        """
+        Role.objects.create(name="DEFAULT", is_default=True)
+        role = create_test_role()
+        perm = create_test_permission()
+        role.permissions.add(perm)
+        first, second = create_test_user(role=role), create_test_user(role=role)
+        first, second = User.objects.get(pk=first.pk), User.objects.get(pk=second.pk)
+
+        self.assertTrue(first.has_module_perms(perm.content_type.app_label))
+        with self.assertNumQueries(1):
+            self.assertTrue(second.has_module_perms(perm.content_type.app_label))
+            self.assertFalse(second.has_module_perms("users"))
+            self.assertFalse(second.has_module_perms("unknown"))
+        self.assertIs(first._app_labels, second._app_labels)
+        self.assertSetEqual(second._app_labels, {perm.content_type.app_label})
+
+    def test_resolve(self):
+        """
+        Test if permission strings resolve to their primary key and content
+        type, and if the resolver follows migrations and permission changes
+        """
+        perm = create_test_permission()
+        perm_str = get_perm_str(perm)
+
+        self.assertTupleEqual(
+            registry.resolve(perm_str), (perm.pk, perm.content_type_id)
+        )
+        with self.assertNumQueries(0):
+            registry.resolve(perm_str)
+        self.assertIsNone(registry.resolve("authmod.unknown_permission"))
+
+        perm.codename = "renamed"
+        perm.save()
+        self.assertIsNone(registry.resolve(perm_str))
+        self.assertIsNotNone(registry.resolve(get_perm_str(perm)))
+
+        registry.resolve(perm_str)
+        permissions_migrated(sender=None)
+        with self.assertNumQueries(1):
+            registry.resolve(perm_str)
+
+
+class BatchedPermissionCheckTestCase(TestCase):
+    def setUp(self):
+        Role.objects.create(name="DEFAULT", is_default=True)
+
+        self.role = create_test_role()
+        self.role_perm = create_test_permission()
+        self.role.permissions.add(self.role_perm)
+
+        self.user_perm = create_test_permission()
+        self.other_perm = create_test_permission()
+
+        self.user = create_test_user(role=self.role)
+        self.user.user_permissions.add(self.user_perm)
+
+    def test_has_perms(self):
+        """
+        Test if has_perms checks role and user permissions together
+        """
+        role_perm = get_perm_str(self.role_perm)
+        user_perm = get_perm_str(self.user_perm)
+        other_perm = get_perm_str(self.other_perm)
+
+        self.assertTrue(self.user.has_perms([]))
+        self.assertTrue(self.user.has_perms([role_perm, user_perm]))
+        self.assertFalse(self.user.has_perms([role_perm, other_perm]))
+        with self.assertRaises(ValueError):
+            self.user.has_perms(role_perm)
+
+    def test_check_perms_many(self):
+        """
+        Test if check_perms_many returns one row per user and one column
+        per permission
+        """
+        role_perm = get_perm_str(self.role_perm)
+        user_perm = get_perm_str(self.user_perm)
+        other = create_test_user(role=self.role)
+        superuser = create_test_user(is_superuser=True)
+
+        matrix = check_perms_many([self.user, other, superuser], [role_perm, user_perm])
+
+        self.assertListEqual(matrix, [[True, True], [True, False], [True, True]])
+
+    def test_check_perms_many_queries(self):
+        """
+        Test if the permissions of every user are loaded together
+        """
+        role_perm = get_perm_str(self.role_perm)
+        user_perm = get_perm_str(self.user_perm)
+        for _ in range(10):
+            create_test_user(role=self.role)
+        check_perms_many(User.objects.all(), [role_perm])
+
+        users = list(User.objects.all())
+        with self.assertNumQueries(1):
+            matrix = check_perms_many(users, [role_perm, user_perm])
+        self.assertEqual(len(matrix), 11)
+        self.assertListEqual(matrix[0], [True, True])
+        self.assertListEqual(matrix[1:], [[True, False]] * 10)
+
+
+class BackendResolutionTestCase(TestCase):
+    def test_backends_are_reused(self):
+        """
+        Test if backends are instantiated once and reset when
+        AUTHENTICATION_BACKENDS changes
+        """
+        backends = _get_backends()
+        self.assertIs(_get_backends(), backends)
+
+        with self.settings(
+            AUTHENTICATION_BACKENDS=["django.contrib.auth.backends.BaseBackend"]
+        ):
+            self.assertIsInstance(_get_backends()[0], BaseBackend)
+            self.assertEqual(len(_get_backend_methods("has_module_perms")), 0)
+
+        self.assertIsInstance(_get_backends()[0], RoleBasedModelBackend)
+
+
+class PrefetchPermissionsTestCase(TestCase):
+    def setUp(self):
+        Role.objects.create(name="DEFAULT", is_default=True)
+
+        self.roles = [create_test_role(), create_test_role()]
+        self.role_perms = [create_test_permission(), create_test_permission()]
+        for role, perm in zip(self.roles, self.role_perms):
+            role.permissions.add(perm)
+
+        self.user_perm = create_test_permission()
+        for index in range(6):
+            user = create_test_user(role=self.roles[index % 2])
+            if index < 2:
+                user.user_permissions.add(self.user_perm)
+
+    def test_prefetch_permissions(self):
+        """
+        Test if prefetch_permissions loads the permissions of a whole
+        queryset with a constant number of queries
+        """
+        perm_strs = [get_perm_str(perm) for perm in self.role_perms]
+        user_perm_str = get_perm_str(self.user_perm)
+        registry.reload()
+
+        with self.assertNumQueries(3):
+            users = list(User.objects.prefetch_permissions().order_by("pk"))
+
+        with self.assertNumQueries(0):
+            for index, user in enumerate(users):
+                self.assertTrue(user.has_perm(perm_strs[index % 2]))
+                self.assertFalse(user.has_perm(perm_strs[(index + 1) % 2]))
+                self.assertEqual(user.has_perm(user_perm_str), index < 2)
+
+
+class LocalRoleCacheTestCase(TestCase):
+    def test_lru_cache_limits(self):
+        """
+        Test if the LRU cache evicts the least recently used entry and
+        expires entries after their TTL
+        """
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set(1, "a")
+        cache.set(2, "b")
+        cache.get(1)
+        cache.set(3, "c")
+
+        self.assertEqual(cache.get(1), "a")
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(3), "c")
+
+        cache = LRUCache(maxsize=2, ttl=-1)
+        cache.set(1, "a")
+        self.assertIsNone(cache.get(1))
+
+    def test_role_permissions_shared_between_users(self):
+        """
+        Test if users with the same role share one in-memory permission set
+        """
+        Role.objects.create(name="DEFAULT", is_default=True)
+        role = create_test_role()
+        role.permissions.add(create_test_permission())
+        users = [create_test_user(role=role), create_test_user(role=role)]
+
+        backend = RoleBasedModelBackend()
+
+        first = backend.get_role_permissions(User.objects.get(pk=users[0].pk))
+        with self.assertNumQueries(0):
+            second = backend.get_role_permissions(users[1])
+
+        self.assertIs(first, second)
+        self.assertIs(first, local_role_cache.get(role.pk))
+
+
+class MultipleRolesTestCase(TestCase):
+    def setUp(self):
+        Role.objects.create(name="DEFAULT", is_default=True)
+
+        self.first, self.second = create_test_role(), create_test_role()
+        self.first_perm, self.second_perm = (
+            create_test_permission(),
+            create_test_permission(),
+        )
+        self.first.permissions.add(self.first_perm)
+        self.second.permissions.add(self.second_perm)
+        registry.reload()
+
+    def create_user(self):
+        user = create_test_user(role=self.first)
+        user.roles.add(self.second)
+        return User.objects.get(pk=user.pk)
+
+    def test_roles_ignored_by_default(self):
+        """
+        Test if additional roles grant nothing unless enabled
+        """
+        user = self.create_user()
+
+        self.assertTrue(user.has_perm(get_perm_str(self.first_perm)))
+        self.assertFalse(user.has_perm(get_perm_str(self.second_perm)))
+
+    def test_permissions_of_all_roles(self):
+        """
+        Test if a user gets the permissions of all their roles, and if users
+        with the same roles share one permission set
+        """
+        with self.settings(AUTHMOD_MULTIPLE_ROLES=True):
+            user, other = self.create_user(), self.create_user()
+            backend = RoleBasedModelBackend()
+
+            self.assertTrue(
+                user.has_perms(
+                    [
+                        get_perm_str(self.first_perm),
+                        get_perm_str(self.second_perm),
+                    ]
+                )
+            )
+            self.assertIs(
+                backend.get_role_permissions(user),
+                backend.get_role_permissions(other),
+            )
+            self.assertSetEqual(
+                set(backend.with_perm(self.second_perm, include_superusers=False)),
+                {user, other},
+            )
+
+            perm = create_test_permission()
+            self.second.permissions.add(perm)
+            user = User.objects.get(pk=user.pk)
+            self.assertTrue(user.has_perm(get_perm_str(perm)))
+
+    def test_prefetch_permissions(self):
+        """
+        Test if the roles of many users are prefetched with a constant
+        number of queries
+        """
+        with self.settings(AUTHMOD_MULTIPLE_ROLES=True):
+            for _ in range(3):
+                self.create_user()
+
+            with self.assertNumQueries(4):
+                users = list(User.objects.prefetch_permissions())
+                for user in users:
+                    user.has_perm(get_perm_str(self.second_perm))
+            self.assertTrue(
+                all(
+                    user.has_perm(get_perm_str(self.second_perm))
+                    for user in users
+                    if user.role_id == self.first.pk
+                )
+            )
+
+
+class RoleHierarchyTestCase(TestCase):
+    def setUp(self):
+        Role.objects.create(name="DEFAULT", is_default=True)
+
+        self.employee = create_test_role()
+        self.manager = create_test_role()
+        self.director = create_test_role()
+        self.manager.parents.add(self.employee)
+        self.director.parents.add(self.manager)
+
+        self.perm = create_test_permission()
+        self.perm_str = f"{self.perm.content_type.app_label}.{self.perm.codename}"
+        self.employee.permissions.add(self.perm)
+        self.user = create_test_user(role=self.director)
+
+    def test_inherited_permissions(self):
+        """
+        Test if a role inherits the permissions of all its ancestors, loaded
+        with a single query
+        """
+        local_role_cache.clear()
+        user = User.objects.get(pk=self.user.pk)
+
+        with self.assertNumQueries(1):
+            perms = RoleBasedModelBackend().get_role_permissions(user)
+        self.assertIn(self.perm_str, perms)
+        self.assertTrue(user.has_perm(self.perm_str))
+
+        perm = create_test_permission()
+        self.employee.permissions.add(perm)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertTrue(user.has_perm(f"{perm.content_type.app_label}.{perm.codename}"))
+
+    def test_remove_parent(self):
+        """
+        Test if removing a parent revokes the inherited permissions of every
+        descendant
+        """
+        self.employee.children.remove(self.manager)
+
+        user = User.objects.get(pk=self.user.pk)
+        self.assertFalse(user.has_perm(self.perm_str))
+        self.assertListEqual(
+            list(self.director.ancestor_links.values_list("ancestor", flat=True)),
+            [self.manager.pk],
+        )
+
+        self.manager.parents.add(self.employee)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertTrue(user.has_perm(self.perm_str))
+
+    def test_reject_cycles(self):
+        """
+        Test if a role can't inherit from itself or its descendants
+        """
+        with self.assertRaises(RoleCycleError), transaction.atomic():
+            self.employee.parents.add(self.director)
+        with self.assertRaises(RoleCycleError), transaction.atomic():
+            self.director.children.add(self.employee)
+        with self.assertRaises(RoleCycleError), transaction.atomic():
+            self.manager.parents.add(self.manager)
+        self.assertFalse(self.employee.parents.exists())
+
+    def test_with_perm(self):
+        """
+        Test if with_perm finds users through inherited permissions
+        """
+        users = RoleBasedModelBackend().with_perm(self.perm, include_superusers=False)
+        self.assertListEqual(list(users), [self.user])
+
+
+class WithPermTestCase(TestCase):
+    def setUp(self):
+        Role.objects.create(name="DEFAULT", is_default=True)
+
+        self.role = create_test_role()
+        self.role_perm = create_test_permission()
+        self.role.permissions.add(self.role_perm)
+        self.user_perm = create_test_permission()
+
+        self.role_user = create_test_user(role=self.role)
+        self.direct_user = create_test_user()
+        self.direct_user.user_permissions.add(self.user_perm)
+        self.inactive_user = create_test_user(role=self.role, is_active=False)
+        self.superuser = create_test_user(is_superuser=True)
+        create_test_user()
+
+    def assertUsers(self, users, expected):
+        self.assertSetEqual(set(users), set(expected))
+
+    def check_with_perm(self):
+        backend = RoleBasedModelBackend()
+        role_perm = get_perm_str(self.role_perm)
+
+        self.assertUsers(backend.with_perm(role_perm), [self.role_user, self.superuser])
+        self.assertUsers(
+            backend.with_perm(self.user_perm, include_superusers=False),
+            [self.direct_user],
+        )
+        self.assertUsers(
+            backend.with_perm([role_perm, self.user_perm], is_active=None),
+            [self.role_user, self.direct_user, self.inactive_user, self.superuser],
+        )
+        with self.assertRaises(ValueError):
+            backend.with_perm("invalid")
+        self.assertUsers(
+            backend.with_perm("authmod.unknown_permission", include_superusers=False),
+            [],
+        )
+
+    def test_with_perm(self):
+        """
+        Test if with_perm finds users through their role, their direct
+        permissions and superuser status
+        """
+        self.check_with_perm()
+
+    def test_with_perm_query(self):
+        """
+        Test if with_perm filters on resolved permission keys, without
+        joining the content type table
+        """
+        backend = RoleBasedModelBackend()
+        backend.with_perm(get_perm_str(self.role_perm))
+        with CaptureQueriesContext(connection) as queries:
+            list(backend.with_perm(get_perm_str(self.role_perm)))
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("django_content_type", queries[0]["sql"])
+
+    def test_with_perm_materialized(self):
+        """
+        Test if with_perm answers from the effective permission table,
+        which signals keep up to date
+        """
+        with self.settings(AUTHMOD_MATERIALIZE_PERMISSIONS=True):
+            refresh_effective_permissions()
+            self.check_with_perm()
+
+            perm = create_test_permission()
+            self.role.permissions.add(perm)
+            self.assertUsers(
+                RoleBasedModelBackend().with_perm(perm, include_superusers=False),
+                [self.role_user],
+            )
+
+            self.role_user.role = Role.objects.get(is_default=True)
+            self.role_user.save()
+            self.assertUsers(
+                RoleBasedModelBackend().with_perm(perm, include_superusers=False),
+                [],
+            )
+
+
+class ObjectPermissionTestCase(TestCase):
+    def setUp(self):
+        Role.objects.create(name="DEFAULT", is_default=True)
+
+        self.perm = create_test_permission()
+        self.perm_str = f"{self.perm.content_type.app_label}.{self.perm.codename}"
+        self.editor = create_test_role()
+        self.editor.permissions.add(self.perm)
+
+        # Roles are the objects permissions are granted on.
+        self.content_type = ContentType.objects.get_for_model(Role)
+        self.first = create_test_role()
+        self.second = create_test_role()
+        self.user = create_test_user()
+        registry.reload()
+
+    def grant(self, user, obj=None):
+        return ObjectRole.objects.create(
+            user=user,
+            role=self.editor,
+            content_type=self.content_type,
+            object_id="" if obj is None else str(obj.pk),
+        )
+
+    def test_object_grant(self):
+        """
+        Test if a role held over an object grants its permissions on that
+        object only
+        """
+        self.grant(self.user, self.first)
+        user = User.objects.get(pk=self.user.pk)
+
+        self.assertTrue(user.has_perm(self.perm_str, self.first))
+        self.assertTrue(user.has_perms([self.perm_str], self.first))
+        self.assertIn(self.perm_str, user.get_all_permissions(self.first))
+        self.assertFalse(user.has_perm(self.perm_str, self.second))
+        self.assertFalse(user.has_perm(self.perm_str))
+
+    def test_content_type_grant(self):
+        """
+        Test if a role held over a content type grants its permissions on
+        every object of that type
+        """
+        self.grant(self.user)
+        user = User.objects.get(pk=self.user.pk)
+
+        self.assertTrue(user.has_perm(self.perm_str, self.first))
+        self.assertTrue(user.has_perm(self.perm_str, self.second))
+        self.assertFalse(user.has_perm(self.perm_str))
+
+    def test_global_permissions(self):
+        """
+        Test if permissions granted globally only apply to objects when
+        AUTHMOD_GLOBAL_OBJECT_PERMISSIONS is enabled
+        """
+        user = create_test_user(role=self.editor)
+        user.user_permissions.add(self.perm)
+        backend = RoleBasedModelBackend()
+
+        for enabled in (False, True):
+            with self.subTest(enabled=enabled), self.settings(
+                AUTHMOD_GLOBAL_OBJECT_PERMISSIONS=enabled
+            ):
+                user = User.objects.get(pk=user.pk)
+                self.assertTrue(user.has_perm(self.perm_str))
+                self.assertEqual(user.has_perm(self.perm_str, self.first), enabled)
+                self.assertEqual(
+                    self.perm_str in user.get_user_permissions(self.first), enabled
+                )
+                self.assertEqual(
+                    self.perm_str in user.get_role_permissions(self.first), enabled
+                )
+                self.assertEqual(
+                    user in backend.with_perm(self.perm_str, obj=self.first), enabled
+                )
+                self.assertEqual(
+                    filter_authorized(user, self.perm_str, Role.objects.all()).exists(),
+                    enabled,
+                )
+
+    def test_filter_authorized(self):
+        """
+        Test if filter_authorized narrows a queryset to the granted objects
+        in a single query
+        """
+        self.grant(self.user, self.first)
+        user = User.objects.get(pk=self.user.pk)
+        RoleBasedModelBackend()._get_perm_mask(user)
+
+        with self.assertNumQueries(1):
+            roles = list(filter_authorized(user, self.perm_str, Role.objects.all()))
+        self.assertListEqual(roles, [self.first])
+
+        self.grant(self.user)
+        roles = filter_authorized(user, self.perm_str, Role.objects.all())
+        self.assertEqual(roles.count(), Role.objects.count())
+
+        superuser = create_test_user(is_superuser=True)
+        roles = filter_authorized(superuser, self.perm_str, Role.objects.all())
+        self.assertEqual(roles.count(), Role.objects.count())
+
+    def test_with_perm_object(self):
+        """
+        Test if with_perm finds users holding a role over the object
+        """
+        self.grant(self.user, self.first)
+        backend = RoleBasedModelBackend()
+
+        self.assertIn(self.user, backend.with_perm(self.perm_str, obj=self.first))
+        self.assertNotIn(self.user, backend.with_perm(self.perm_str, obj=self.second))
+
+
+class PermissionSnapshotTestCase(TestCase):
+    def setUp(self):
+        Role.objects.create(name="DEFAULT", is_default=True)
+
+        self.role = create_test_role()
+        self.role_perm = create_test_permission()
+        self.role.permissions.add(self.role_perm)
+        self.user_perm = create_test_permission()
+
+        self.user = create_test_user(role=self.role)
+        self.user.user_permissions.add(self.user_perm)
+        self.client.force_login(self.user)
+
+    def get_user(self):
+        request = RequestFactory().get("/")
+        request.session = self.client.session
+        PermissionSnapshotMiddleware(lambda request: None)(request)
+        request.user.pk
+        if request.session.modified:
+            request.session.save()
+        return request.user
+
+    def test_snapshot_permission_checks(self):
+        """
+        Test if permission checks are answered from the session snapshot
+        without queries besides loading the user
+        """
+        # Warm the role cache, which is shared by every user of the role.
+        self.get_user().get_role_permissions()
+        registry.reload()
+
+        with self.assertNumQueries(2):
+            user = self.get_user()
+        with self.assertNumQueries(0):
+            self.assertTrue(user.has_perm(get_perm_str(self.role_perm)))
+            self.assertTrue(user.has_perm(get_perm_str(self.user_perm)))
+
+    def test_snapshot_outdated(self):
+        """
+        Test if the snapshot is refreshed once the user permissions change
+        """
+        self.get_user()
+        self.user.user_permissions.remove(self.user_perm)
+
+        user = self.get_user()
+        self.assertFalse(user.has_perm(get_perm_str(self.user_perm)))
+
+        session = self.client.session
+        session[SNAPSHOT_SESSION_KEY] = "tampered"
+        session.save()
+        user = self.get_user()
+        self.assertTrue(user.has_perm(get_perm_str(self.role_perm)))
+
+    def test_snapshot_permission_deleted(self):
+        """
+        Test if the snapshot is refreshed once a permission of the user is
+        deleted
+        """
+        self.get_user()
+        version = get_user_version(self.user.pk)
+        self.user_perm.delete()
+        self.assertNotEqual(get_user_version(self.user.pk), version)
+
+        user = self.get_user()
+        self.assertTrue(user.has_perm(get_perm_str(self.role_perm)))
+        self.assertFalse(user.has_perm(get_perm_str(self.user_perm)))
+
+    def test_snapshot_missing_permission(self):
+        """
+        Test if a snapshot holding an unknown permission is rejected without
+        reloading the registry on every request
+        """
+        self.get_user()
+        registry.reload()
+        missing = Permission.objects.order_by("-pk").first().pk + 1
+        with self.assertNumQueries(0):
+            self.assertFalse(registry.has_pks([missing]))
+            self.assertEqual(registry.mask_from_pks([missing]), 0)
+            self.assertEqual(registry.mask_from_pks([missing]), 0)
+
+
+class AsyncPermissionCheckTestCase(TestCase):
+    def setUp(self):
+        Role.objects.create(name="DEFAULT", is_default=True)
+
+        self.role = create_test_role()
+        self.role_perm = create_test_permission()
+        self.role.permissions.add(self.role_perm)
+        self.user_perm = create_test_permission()
+
+        self.user = create_test_user(role=self.role)
+        self.user.user_permissions.add(self.user_perm)
+
+    async def test_async_permission_checks(self):
+        """
+        Test if async permission checks give the same answers as the sync
+        ones
+        """
+        role_perm = get_perm_str(self.role_perm)
+        user_perm = get_perm_str(self.user_perm)
+        user = await User.objects.aget(pk=self.user.pk)
+
+        self.assertTrue(await user.ahas_perm(role_perm))
+        self.assertTrue(await user.ahas_perms([role_perm, user_perm]))
+        self.assertFalse(await user.ahas_perm("authmod.unknown_permission"))
+        self.assertTrue(
+            await user.ahas_module_perms(self.role_perm.content_type.app_label)
+        )
+        self.assertSetEqual(await user.aget_all_permissions(), {role_perm, user_perm})
+        self.assertSetEqual(await user.aget_role_permissions(), {role_perm})
+
+    async def test_awith_perm(self):
+        """
+        Test if awith_perm returns a queryset usable with the async API
+        """
+        users = await RoleBasedModelBackend().awith_perm(
+            self.user_perm, include_superusers=False
+        )
+        self.assertListEqual([user.pk async for user in users], [self.user.pk])
+
+    async def test_awith_perm_object(self):
+        """
+        Test if awith_perm resolves the content type of the object and the
+        permissions without sync queries
+        """
+        other = await User.objects.aget(pk=self.user.pk)
+        await ObjectRole.objects.acreate(
+            user=other,
+            role=self.role,
+            content_type=await ContentType.objects.aget(
+                app_label="authmod", model="role"
+            ),
+            object_id=str(self.role.pk),
+        )
+        ContentType.objects.clear_cache()
+        registry.invalidate()
+
+        users = await RoleBasedModelBackend().awith_perm(
+            get_perm_str(self.role_perm), include_superusers=False, obj=self.role
+        )
+        self.assertListEqual([user.pk async for user in users], [self.user.pk])
+
+
+class RoleReassignmentTestCase(TestCase):
+    def setUp(self):
+        self.default_role = Role.objects.create(name="DEFAULT", is_default=True)
+        self.old_role = create_test_role()
+        self.new_role = create_test_role()
+        self.users = [create_test_user(role=self.old_role) for _ in range(5)]
+        self.other_user = create_test_user()
+
+    def assertRole(self, users, role):
+        for user in users:
+            self.assertEqual(User.objects.get(pk=user.pk).role_id, role.pk)
+
+    def test_reassign_roles(self):
+        """
+        Test if users of a queryset are updated in chunks, reporting progress
+        and bumping the version of the updated users only
+        """
+        user_ids = [user.pk for user in self.users[:3]]
+        versions = {user.pk: get_user_version(user.pk) for user in self.users}
+        calls = []
+
+        with CaptureQueriesContext(connection) as queries:
+            count = reassign_roles(
+                User.objects.filter(pk__in=user_ids),
+                self.new_role,
+                batch_size=2,
+                progress=lambda done, total: calls.append((done, total)),
+            )
+
+        updates = [q for q in queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(count, 3)
+        self.assertEqual(len(updates), 2)
+        self.assertListEqual(calls, [(2, 3), (3, 3)])
+        self.assertRole(self.users[:3], self.new_role)
+        self.assertRole(self.users[3:], self.old_role)
+        for user in self.users:
+            changed = get_user_version(user.pk) != versions[user.pk]
+            self.assertEqual(changed, user.pk in user_ids)
+        self.assertEqual(reassign_roles(User.objects.all(), None), 5)
+        self.assertRole(self.users + [self.other_user], self.default_role)
+
+    def test_migrate_role(self):
+        """
+        Test if every user of a role is moved to another role, and if the
+        effective permission table follows
+        """
+        perm = create_test_permission()
+        self.new_role.permissions.add(perm)
+        with self.settings(AUTHMOD_MATERIALIZE_PERMISSIONS=True):
+            self.assertEqual(migrate_role(self.old_role, self.new_role), 5)
+            self.assertSetEqual(
+                set(RoleBasedModelBackend().with_perm(perm)), set(self.users)
+            )
+        self.assertRole(self.users, self.new_role)
+        self.assertRole([self.other_user], self.default_role)
+
+    def test_reassign_roles_from_csv(self):
+        """
+        Test if roles are reassigned from a CSV file, and if unknown roles
+        are refused before updating anyone
+        """
+        rows = ["username,role"]
+        rows += [f"{user.email_address},{self.new_role.name}" for user in self.users]
+        rows.append(f"{self.other_user.email_address},{self.old_role.name}")
+        rows.append(f"unknown@example.com,{self.old_role.name}")
+
+        self.assertEqual(reassign_roles_from_csv(StringIO("\n".join(rows))), 6)
+        self.assertRole(self.users, self.new_role)
+        self.assertRole([self.other_user], self.old_role)
+
+        rows.append(f"{self.other_user.email_address},unknown")
+        with self.assertRaises(Role.DoesNotExist):
+            reassign_roles_from_csv(StringIO("\n".join(rows)))
+
+    def test_reassign_roles_command(self):
+        """
+        Test if the command moves the users of a role and reports progress
+        """
+        out = StringIO()
+        call_command(
+            "reassign_roles",
+            old_role=self.old_role.name,
+            new_role=self.new_role.name,
+            batch_size=2,
+            stdout=out,
+        )
+        self.assertListEqual(
+            out.getvalue().splitlines(), ["2/5", "4/5", "5/5", "5 users reassigned."]
+        )
+        self.assertRole(self.users, self.new_role)
+
+        with self.assertRaises(CommandError):
+            call_command("reassign_roles", old_role=self.old_role.name)
+
+
+class RolePermissionSyncTestCase(TestCase):
+    def setUp(self):
+        Role.objects.create(name="DEFAULT", is_default=True)
+        self.roles = [create_test_role() for _ in range(3)]
+        self.perms = [create_test_permission() for _ in range(4)]
+        self.perm_strs = [get_perm_str(perm) for perm in self.perms]
+
+    def assertPerms(self, role, perms):
+        self.assertSetEqual(set(role.permissions.all()), set(perms))
+
+    def test_sync_role_permissions(self):
+        """
+        Test if only the difference with the current permissions is written,
+        and if roles left out of the policy are untouched
+        """
+        first, second, third = self.roles
+        first.permissions.add(*self.perms[:2])
+        second.permissions.add(*self.perms[1:3])
+        third.permissions.add(self.perms[3])
+
+        policy = {
+            first.name: self.perm_strs[1:3],
+            second.name: self.perm_strs[1:3],
+        }
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTupleEqual(sync_role_permissions(policy), (1, 1))
+        statements = [q["sql"] for q in queries]
+        self.assertEqual(sum("DELETE" in sql for sql in statements), 1)
+        self.assertEqual(sum("INSERT" in sql for sql in statements), 1)
+
+        self.assertPerms(first, self.perms[1:3])
+        self.assertPerms(second, self.perms[1:3])
+        self.assertPerms(third, self.perms[3:])
+        self.assertTupleEqual(sync_role_permissions(policy), (0, 0))
+
+    def test_sync_invalidates_roles(self):
+        """
+        Test if users see the permissions of the synced policy
+        """
+        role = self.roles[0]
+        role.permissions.add(self.perms[0])
+        user = create_test_user(role=role)
+        self.assertTrue(User.objects.get(pk=user.pk).has_perm(self.perm_strs[0]))
+
+        sync_role_permissions({role.name: [self.perm_strs[1]]})
+
+        user = User.objects.get(pk=user.pk)
+        self.assertFalse(user.has_perm(self.perm_strs[0]))
+        self.assertTrue(user.has_perm(self.perm_strs[1]))
+
+    def test_sync_unknown(self):
+        """
+        Test if unknown roles and permissions are refused before anything is
+        written
+        """
+        role = self.roles[0]
+        role.permissions.add(self.perms[0])
+
+        with self.assertRaises(Role.DoesNotExist):
+            sync_role_permissions({role.name: [], "unknown": []})
+        with self.assertRaises(Permission.DoesNotExist):
+            sync_role_permissions({role.name: ["authmod.unknown_permission"]})
+        self.assertPerms(role, self.perms[:1])
+
+
+class BenchmarkCommandTestCase(TestCase):
+    def test_benchmark_permissions(self):
+        """
+        Test if the benchmark reports every operation cold and warm, and
+        leaves no seeded rows behind
+        """
+        out = StringIO()
+        call_command(
+            "benchmark_permissions",
+            users=5,
+            roles=2,
+            permissions=5,
+            iterations=2,
+            stdout=out,
+        )
+        results = json.loads(out.getvalue())["results"]
+
+        self.assertIn("user.has_perm", results)
+        self.assertIn("backend.with_perm", results)
+        self.assertEqual(results["user.has_perm"]["cold"]["calls"], 2)
+        self.assertEqual(results["user.has_perm"]["warm"]["queries"], 0)
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Role.objects.exists())
+
+
+class InstrumentationTestCase(TestCase):
+    def setUp(self):
+        Role.objects.create(name="DEFAULT", is_default=True)
+
+        self.role = create_test_role()
+        self.perm = create_test_permission()
+        self.perm_str = f"{self.perm.content_type.app_label}.{self.perm.codename}"
+        self.role.permissions.add(self.perm)
+        self.user = create_test_user(role=self.role)
+        stats.reset()
+
+    def test_disabled(self):
+        """
+        Test if nothing is recorded unless instrumentation is enabled
+        """
+        User.objects.get(pk=self.user.pk).has_perm(self.perm_str)
+
+        snapshot = stats.snapshot()
+        self.assertFalse(snapshot["enabled"])
+        self.assertDictEqual(snapshot["methods"], {})
+        self.assertDictEqual(snapshot["cache"], {})
+
+    def test_record_checks(self):
+        """
+        Test if backend calls, their queries, cache lookups and checked
+        permissions are recorded and sent to the signal
+        """
+        calls = []
+
+        def receiver(sender, method, perms, **kwargs):
+            calls.append((sender, method, perms))
+
+        permission_checked.connect(receiver)
+        self.addCleanup(permission_checked.disconnect, receiver)
+
+        local_role_cache.clear()
+        with self.settings(AUTHMOD_INSTRUMENTATION=True):
+            user = User.objects.get(pk=self.user.pk)
+            self.assertTrue(user.has_perm(self.perm_str))
+            self.assertTrue(user.has_perm(self.perm_str))
+
+        snapshot = stats.snapshot()
+        method = snapshot["methods"]["RoleBasedModelBackend.has_perm"]
+        self.assertEqual(method["calls"], 2)
+        self.assertGreater(method["queries"], 0)
+        self.assertEqual(sum(method["histogram_us"].values()), 2)
+        self.assertEqual(snapshot["cache"]["local.misses"], 1)
+        self.assertListEqual(snapshot["top_permissions"], [(self.perm_str, 2)])
+        self.assertEqual(
+            calls[0], (RoleBasedModelBackend, "has_perm", (self.perm_str,))
+        )
+
+        out = StringIO()
+        call_command("permission_stats", reset=True, stdout=out)
+        self.assertIn(
+            "RoleBasedModelBackend.has_perm", json.loads(out.getvalue())["methods"]
+        )
+        self.assertDictEqual(stats.snapshot()["methods"], {})
+
+
+class InvalidationTestCase(TestCase):
+    def setUp(self):
+        invalidation.reset_transport()
+        self.addCleanup(invalidation.reset_transport)
+
+    def get_generation(self):
+        return InvalidationGeneration.objects.values_list(
+            "generation", flat=True
+        ).first()
+
+    def test_publish_on_commit(self):
+        """
+        Test if permission changes increment the generation once committed
+        """
+        role = create_test_role()
+        with self.captureOnCommitCallbacks(execute=True):
+            role.permissions.add(create_test_permission())
+        generation = self.get_generation()
+        self.assertIsNotNone(generation)
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            role.permissions.clear()
+        self.assertEqual(self.get_generation(), generation)
+        for callback in callbacks:
+            callback()
+        self.assertGreater(self.get_generation(), generation)
+
+    def test_poll(self):
+        """
+        Test if a process drops its local permission data once another
+        process published a change, polling at most once per interval
+        """
+        middleware = InvalidationMiddleware(lambda request: None)
+        request = RequestFactory().get("/")
+        middleware(request)
+        local_role_cache.set(1, frozenset())
+
+        # Another process publishes a change.
+        invalidation.DatabaseTransport().publish(invalidation.ROLE, [1])
+        with self.settings(AUTHMOD_INVALIDATION_POLL_INTERVAL=60):
+            with self.assertNumQueries(0):
+                middleware(request)
+            self.assertIsNotNone(local_role_cache.get(1))
+
+        with self.settings(AUTHMOD_INVALIDATION_POLL_INTERVAL=0):
+            with self.assertNumQueries(1):
+                middleware(request)
+        self.assertIsNone(local_role_cache.get(1))
+        self.assertFalse(registry._loaded)
+
+
+class RoleAdminTestCase(TestCase):
+    def setUp(self):
+        Role.objects.create(name="DEFAULT", is_default=True)
+        self.client = Client()
+        self.client.force_login(create_test_user(is_superuser=True, _is_staff=True))
+
+    def create_roles(self, count):
+        for _ in range(count):
+            role = create_test_role()
+            role.permissions.add(create_test_permission(), create_test_permission())
+            create_test_user(role=role)
+
+    def test_changelist_queries(self):
+        """
+        Test if the role changelist shows user and permission counts with a
+        number of queries independent of the number of roles
+        """
+        self.create_roles(2)
+        self.client.get("/admin/authmod/role/")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/admin/authmod/role/")
+        self.assertEqual(response.status_code, 200)
+
+        self.create_roles(5)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get("/admin/authmod/role/")
+        role = response.context["cl"].result_list[0]
+        self.assertEqual(role.user_count, 1)
+        self.assertEqual(role.permission_count, 2)
+
+    def test_change_form_queries(self):
+        """
+        Test if the role change form doesn't load permissions one by one
+        """
+        role = create_test_role()
+        role.permissions.add(create_test_permission())
+        url = f"/admin/authmod/role/{role.pk}/change/"
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        role.permissions.add(*[create_test_permission() for _ in range(5)])
+        with self.assertNumQueries(len(queries)):
+            self.client.get(url)
+
+        response = self.client.get(
+            "/admin/autocomplete/",
+            {
+                "app_label": "authmod",
+                "model_name": "role",
+                "field_name": "permissions",
+                "term": role.permissions.first().codename,
+            },
+        )
+        self.assertEqual(len(response.json()["results"]), 1)
+
+    def test_change_form_rejects_cycles(self):
+        """
+        Test if the role change form shows an error instead of saving a
+        cycle
+        """
+        parent, child = create_test_role(), create_test_role()
+        child.parents.add(parent)
+
+        response = self.client.post(
+            f"/admin/authmod/role/{parent.pk}/change/",
+            {"name": parent.name, "parents": [child.pk], "permissions": []},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("parents", response.context["adminform"].form.errors)
+        self.assertFalse(parent.parents.exists())
+
+    def test_permission_admin_read_only(self):
+        """
+        Test if permissions can be searched but not added, changed or
+        deleted through the admin
+        """
+        perm = create_test_permission()
+        for url in (
+            "/admin/auth/permission/add/",
+            f"/admin/auth/permission/{perm.pk}/change/",
+            f"/admin/auth/permission/{perm.pk}/delete/",
+        ):
+            response = self.client.post(url, {"name": "Changed", "post": "yes"})
+            self.assertEqual(response.status_code, 403, url)
+        self.assertTrue(Permission.objects.filter(pk=perm.pk, name=perm.name).exists())
+        self.assertEqual(self.client.get("/admin/auth/permission/").status_code, 200)
+
+    def test_role_editor_searches_permissions(self):
+        """
+        Test if a staff user who may change roles, but not view permissions,
+        can use the permission autocomplete
+        """
+        perm = create_test_permission()
+        role = create_test_role()
+        role.permissions.add(
+            Permission.objects.get(
+                content_type__app_label="authmod", codename="view_role"
+            ),
+            Permission.objects.get(
+                content_type__app_label="authmod", codename="change_role"
+            ),
+        )
+        client = Client()
+        client.force_login(create_test_user(role=role, _is_staff=True))
+
+        response = client.get(
+            "/admin/autocomplete/",
+            {
+                "app_label": "authmod",
+                "model_name": "role",
+                "field_name": "permissions",
+                "term": perm.codename,
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 1)
+        response = client.post(f"/admin/auth/permission/{perm.pk}/change/", {})
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(
+    AUTHMOD_FAST_AUTHENTICATION=True,
+    AUTHMOD_AUTHENTICATION_WORKERS=0,
+    AUTHMOD_REHASH_DELAY=60,
+    PASSWORD_HASHERS=[
+        "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+        "django.contrib.auth.hashers.MD5PasswordHasher",
+    ],
+)
+class FastAuthenticationTestCase(TestCase):
+    def setUp(self):
+        Role.objects.create(name="DEFAULT", is_default=True)
+        self.user = create_test_user(
+            email_address="Someone@example.com", password="secret"
+        )
+
+    def test_authenticate(self):
+        """
+        Test if users are found by a case insensitive email lookup loading
+        only the fields needed to authenticate
+        """
+        with self.assertNumQueries(1):
+            user = authenticate(username="someone@EXAMPLE.com", password="secret")
+        self.assertEqual(user, self.user)
+        self.assertIn("first_name", user.get_deferred_fields())
+        self.assertNotIn("password", user.get_deferred_fields())
+
+        self.assertIsNone(authenticate(username="someone@example.com", password="x"))
+        self.assertIsNone(authenticate(username="nobody@example.com", password="x"))
+
+    def test_authenticate_ambiguous_case(self):
+        """
+        Test if only an exact match is accepted between emails differing by
+        case
+        """
+        other = create_test_user(email_address="someone@example.com", password="secret")
+
+        self.assertEqual(
+            authenticate(username="someone@example.com", password="secret"), other
+        )
+        self.assertIsNone(
+            authenticate(username="SOMEONE@example.com", password="secret")
+        )
+
+    def test_batched_rehash(self):
+        """
+        Test if outdated hashes are upgraded in a batch after login, unless
+        the password changed meanwhile
+        """
+        User.objects.filter(pk=self.user.pk).update(
+            password=make_password("secret", hasher="md5")
+        )
+        other = create_test_user(password="other")
+        User.objects.filter(pk=other.pk).update(
+            password=make_password("other", hasher="md5")
+        )
+
+        self.assertIsNotNone(
+            authenticate(username=self.user.email_address, password="secret")
+        )
+        self.assertIsNotNone(
+            authenticate(username=other.email_address, password="other")
+        )
+        self.assertTrue(User.objects.get(pk=self.user.pk).password.startswith("md5$"))
+
+        changed = make_password("changed", hasher="md5")
+        User.objects.filter(pk=other.pk).update(password=changed)
+        with self.assertNumQueries(1):
+            flush_rehashes()
+
+        user = User.objects.get(pk=self.user.pk)
+        self.assertTrue(user.password.startswith("pbkdf2_sha256$"))
+        self.assertTrue(user.check_password("secret"))
+        self.assertEqual(User.objects.get(pk=other.pk).password, changed)
+
+    def test_rehash_queue_size(self):
+        """
+        Test if no more than REHASH_QUEUE_SIZE passwords wait for an upgrade
+        """
+        other = create_test_user(password="other")
+        encoded = make_password("secret", hasher="md5")
+        other_encoded = make_password("other", hasher="md5")
+        User.objects.filter(pk=self.user.pk).update(password=encoded)
+        User.objects.filter(pk=other.pk).update(password=other_encoded)
+
+        with mock.patch("authmod.passwords.REHASH_QUEUE_SIZE", 1):
+            self.assertTrue(
+                schedule_rehash(self.user.pk, encoded, make_password("secret"))
+            )
+            self.assertFalse(
+                schedule_rehash(other.pk, other_encoded, make_password("other"))
+            )
+            self.assertTrue(
+                schedule_rehash(self.user.pk, encoded, make_password("secret"))
+            )
+        flush_rehashes()
+
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password("secret"))
+        self.assertFalse(User.objects.get(pk=self.user.pk).password.startswith("md5$"))
+        self.assertEqual(User.objects.get(pk=other.pk).password, other_encoded)
+
+    def test_rehash_keeps_session(self):
+        """
+        Test if a session started with an outdated hash stays valid before
+        and after the upgraded hash is stored
+        """
+        encoded = make_password("secret", hasher="md5")
+        User.objects.filter(pk=self.user.pk).update(
+            password=encoded, is_superuser=True, _is_staff=True
+        )
+
+        self.assertTrue(
+            self.client.login(username=self.user.email_address, password="secret")
+        )
+        self.assertEqual(self.client.get("/admin/").status_code, 200)
+        self.assertEqual(User.objects.get(pk=self.user.pk).password, encoded)
+        new_encoded = get_pending_hash(self.user.pk, encoded)
+        self.assertTrue(new_encoded.startswith("pbkdf2_sha256$"))
+
+        # Other processes find the upgraded hash in the cache.
+        with mock.patch.dict("authmod.passwords._pending_rehashes", clear=True):
+            self.assertEqual(get_pending_hash(self.user.pk, encoded), new_encoded)
+
+        flush_rehashes()
+        self.assertEqual(User.objects.get(pk=self.user.pk).password, new_encoded)
+        self.assertEqual(get_pending_hash(self.user.pk, encoded), encoded)
+        self.assertEqual(self.client.get("/admin/").status_code, 200)
+
+    async def test_aauthenticate(self):
+        """
+        Test if async authentication hashes in the worker pool
+        """
+        with self.settings(AUTHMOD_AUTHENTICATION_WORKERS=1):
+            user = await RoleBasedModelBackend().aauthenticate(
+                None, username="SOMEONE@example.com", password="secret"
+            )
+        self.assertEqual(user, self.user)
+
+    async def test_aauthenticate_function(self):
+        """
+        Test if aauthenticate() goes through the async method of the backend
+        """
+        with mock.patch.object(
+            RoleBasedModelBackend, "authenticate", side_effect=AssertionError
+        ):
+            user = await aauthenticate(
+                username="someone@example.com", password="secret"
+            )
+        self.assertEqual(user, self.user)
+        self.assertEqual(user.backend, "authmod.backends.RoleBasedModelBackend")
+        self.assertIsNone(
+            await aauthenticate(username=user.email_address, password="x")
+        )
+
+
+class GetUserTestCase(TestCase):
+    def test_get_user(self):
+        """
+        Test if the user is loaded with their role in one query
+        """
+        role = Role.objects.create(name="DEFAULT", is_default=True)
+        user = create_test_user(_is_staff=True)
+
+        with self.assertNumQueries(1):
+            loaded = RoleBasedModelBackend().get_user(user.pk)
+            self.assertEqual(loaded.role, role)
+            self.assertTrue(loaded.is_staff)
+            self.assertEqual(
+                loaded.get_session_auth_hash(), user.get_session_auth_hash()
+            )
+            self.assertEqual(str(loaded), str(user))
+        self.assertFalse(loaded.get_deferred_fields())
+
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        self.assertIsNone(RoleBasedModelBackend().get_user(user.pk))
+        self.assertIsNone(RoleBasedModelBackend().get_user(0))
+
+    @override_settings(AUTHMOD_REQUEST_USER_FIELDS=["first_name"])
+    def test_get_user_fields(self):
+        """
+        Test if only the configured fields, the username and the fields
+        needed for authorization are loaded with AUTHMOD_REQUEST_USER_FIELDS
+        """
+        role = Role.objects.create(name="DEFAULT", is_default=True)
+        user = create_test_user(_is_staff=True)
+
+        with self.assertNumQueries(1):
+            loaded = RoleBasedModelBackend().get_user(user.pk)
+            self.assertEqual(loaded.role, role)
+            self.assertTrue(loaded.is_staff)
+            self.assertTrue(loaded.is_active)
+            self.assertEqual(loaded.get_username(), user.get_username())
+            self.assertEqual(loaded.first_name, user.first_name)
+            self.assertEqual(
+                loaded.get_session_auth_hash(), user.get_session_auth_hash()
+            )
+        self.assertEqual(loaded.get_deferred_fields(), {"last_name", "last_login"})
@@ -70,6 +70,7 @@ class UserAdmin(BaseUserAdmin):
     add_form = UserCreationForm
 
     list_display = ("first_name", "last_name", "email_address", "role")
+    list_select_related = ("role",)
     list_filter = ("role",)
     fieldsets = (
         (None, {"fields": ("email_address", "password")}),
@@ -1,7 +1,22 @@
+from itertools import islice
+
 from django.contrib.auth.models import BaseUserManager
+from django.db import IntegrityError, transaction
+
+from authmod.exceptions import DefaultRoleNotFound
+from authmod.managers import RolePermissionsQuerySet
+from authmod.materialize import refresh_materialized
+from authmod.models import get_default_role_id
+from authmod.passwords import get_hashing_executor, hash_passwords
 
 
 class UserManager(BaseUserManager):
+    def get_queryset(self):
+        return RolePermissionsQuerySet(self.model, using=self._db)
+
+    def prefetch_permissions(self):
+        return self.get_queryset().prefetch_permissions()
+
     def create_user(self, **kwargs):
         """
         Creates and saves a User with the given email and password.
@@ -22,6 +37,119 @@ class UserManager(BaseUserManager):
         user.save(using=self._db)
         return user
 
+    def bulk_create_users(self, rows, batch_size=1000, workers=None):
+        """
+        Creates Users from an iterable of dicts of field values, each with a
+        raw `password`. Passwords are hashed across `workers` processes (all
+        CPUs by default, in this process when 0) and users are inserted in
+        batches of `batch_size`.
+
+        Returns a tuple `(users, errors)` of the created users and a list of
+        `(index, row, exception)` for the rows which could not be created.
+        """
+        users = []
+        errors = []
+        seen = set()
+        default_role_id = None
+
+        executor = get_hashing_executor(workers)
+        try:
+            rows = enumerate(rows)
+            while batch := list(islice(rows, batch_size)):
+                pending = []
+                for index, row in batch:
+                    try:
+                        user, password = self._build_user(row, seen)
+                        if user.role_id is None and not user.is_superuser:
+                            if default_role_id is None:
+                                default_role_id = get_default_role_id()
+                            user.role_id = default_role_id
+                    except (DefaultRoleNotFound, TypeError, ValueError) as e:
+                        errors.append((index, row, e))
+                    else:
+                        pending.append((index, row, user, password))
+
+                existing = set(
+                    self.filter(
+                        email_address__in=[
+                            user.email_address for _, _, user, _ in pending
+                        ]
+                    ).values_list("email_address", flat=True)
+                )
+                batch = []
+                for index, row, user, password in pending:
+                    if user.email_address in existing:
+                        errors.append(
+                            (index, row, ValueError("Email address is already in use"))
+                        )
+                    else:
+                        batch.append((index, row, user, password))
+
+                hashes = hash_passwords(
+                    (password for _, _, _, password in batch), executor
+                )
+                for (_, _, user, _), password in zip(batch, hashes):
+                    user.password = password
+
+                users.extend(self._insert_users(batch, errors))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        return users, errors
+
+    def _build_user(self, row, seen):
+        kwargs = dict(row)
+
+        email_address = kwargs.pop("email_address", None)
+        if not email_address:
+            raise ValueError("Users must have an email address")
+
+        password = kwargs.pop("password", None)
+        if not password:
+            raise ValueError("Users must have a password")
+
+        email_address = self.normalize_email(email_address)
+        if email_address in seen:
+            raise ValueError("Email address is already in use")
+        seen.add(email_address)
+
+        return self.model(email_address=email_address, **kwargs), password
+
+    def _insert_users(self, batch, errors):
+        users = [user for _, _, user, _ in batch]
+        try:
+            with transaction.atomic(using=self._db):
+                users = self.bulk_create(users)
+                # bulk_create() sends no post_save signal.
+                refresh_materialized(user_ids=self._get_user_ids(users))
+                return users
+        except IntegrityError:
+            pass
+
+        # Another row conflicts with the batch, find out which one by
+        # inserting them one at a time.
+        users = []
+        for index, row, user, _ in batch:
+            try:
+                with transaction.atomic(using=self._db):
+                    user.save(using=self._db)
+            except IntegrityError as e:
+                errors.append((index, row, e))
+            else:
+                users.append(user)
+        return users
+
+    def _get_user_ids(self, users):
+        if all(user.pk is not None for user in users):
+            return [user.pk for user in users]
+        # Databases which can't return the primary keys of inserted rows.
+        return list(
+            self.filter(
+                email_address__in=[user.email_address for user in users]
+            ).values_list("pk", flat=True)
+        )
+
     def create_superuser(self, email_address, password=None):
         """
         Creates and saves a superuser with the given email and password.
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authmod", "0005_user_role"),
+        ("users", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="roles",
+            field=models.ManyToManyField(
+                blank=True,
+                help_text="Roles the user has besides their main role, used when AUTHMOD_MULTIPLE_ROLES is enabled.",
+                related_name="+",
+                through="authmod.UserRole",
+                to="authmod.role",
+                verbose_name="additional roles",
+            ),
+        ),
+    ]
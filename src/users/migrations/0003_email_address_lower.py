@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-17 00:29
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0002_user_roles"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(
+                django.db.models.functions.text.Lower("email_address"),
+                name="user_email_address_lower",
+            ),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractBaseUser
 from django.db import models
+from django.db.models.functions import Lower
 from django.utils.translation import gettext_lazy as _
 
 from authmod.models import RolePermissionsMixin
@@ -33,6 +34,9 @@ class User(AbstractBaseUser, RolePermissionsMixin):
     class Meta:
         db_table = "user"
         default_permissions = ()
+        indexes = [
+            models.Index(Lower("email_address"), name="user_email_address_lower"),
+        ]
 
     @property
     def is_staff(self):
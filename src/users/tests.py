@@ -1,5 +1,13 @@
+from django.contrib.auth.hashers import check_password
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
 from faker import Faker
 
+from authmod.backends import RoleBasedModelBackend
+from authmod.models import Role
 from users.models import User
 
 faker = Faker()
@@ -14,3 +22,87 @@ def create_test_user(**kwargs):
         **kwargs,
     }
     return User.objects.create(**data)
+
+
+class BulkCreateUsersTestCase(TestCase):
+    def setUp(self):
+        self.role = Role.objects.create(name="DEFAULT", is_default=True)
+
+    def test_bulk_create_users(self):
+        """
+        Test if users are created with normalized emails, hashed passwords
+        and the default role, and rows which fail are reported
+        """
+        existing = create_test_user()
+        rows = [
+            {"email_address": "first@EXAMPLE.com", "password": "secret-1"},
+            {"email_address": "second@example.com", "password": "secret-2"},
+            {"email_address": "first@example.com", "password": "secret-3"},
+            {"email_address": existing.email_address, "password": "secret-4"},
+            {"email_address": "third@example.com"},
+        ]
+
+        users, errors = User.objects.bulk_create_users(rows, batch_size=2, workers=0)
+
+        self.assertListEqual(
+            [user.email_address for user in users],
+            ["first@example.com", "second@example.com"],
+        )
+        self.assertListEqual([index for index, _, _ in errors], [2, 3, 4])
+
+        user = User.objects.get(email_address="first@example.com")
+        self.assertEqual(user.role_id, self.role.pk)
+        self.assertTrue(check_password("secret-1", user.password))
+
+    def test_bulk_create_users_in_processes(self):
+        """
+        Test if passwords are hashed by a process pool
+        """
+        rows = [
+            {"email_address": f"user{index}@example.com", "password": f"pw-{index}"}
+            for index in range(3)
+        ]
+
+        users, errors = User.objects.bulk_create_users(rows, workers=2)
+
+        self.assertListEqual(errors, [])
+        for index, user in enumerate(users):
+            self.assertTrue(user.check_password(f"pw-{index}"))
+
+    def test_bulk_create_users_materialized(self):
+        """
+        Test if bulk created users get their effective permission rows
+        """
+        perm = Permission.objects.create(
+            name="Test Permission",
+            codename="test_permission",
+            content_type=ContentType.objects.get_for_model(Permission),
+        )
+        self.role.permissions.add(perm)
+        rows = [{"email_address": "user@example.com", "password": "secret"}]
+
+        with self.settings(AUTHMOD_MATERIALIZE_PERMISSIONS=True):
+            users, _ = User.objects.bulk_create_users(rows, workers=0)
+            self.assertListEqual(
+                list(RoleBasedModelBackend().with_perm(perm, include_superusers=False)),
+                users,
+            )
+
+
+class UserAdminTestCase(TestCase):
+    def test_changelist_queries(self):
+        """
+        Test if the user changelist loads the roles with the users
+        """
+        Role.objects.create(name="DEFAULT", is_default=True)
+        client = Client()
+        client.force_login(create_test_user(is_superuser=True, _is_staff=True))
+        create_test_user()
+
+        with CaptureQueriesContext(connection) as queries:
+            client.get("/admin/users/user/")
+        for _ in range(5):
+            create_test_user(role=Role.objects.create(name=faker.user_name()))
+        with self.assertNumQueries(len(queries)):
+            response = client.get("/admin/users/user/")
+        self.assertEqual(response.status_code, 200)